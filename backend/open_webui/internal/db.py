@@ -1,8 +1,10 @@
 import json
 import logging
+import re
 from contextlib import contextmanager
 from typing import Any, Optional
 
+import orjson
 from open_webui.internal.wrappers import register_connection
 from open_webui.env import (
     OPEN_WEBUI_DIR,
@@ -26,16 +28,41 @@ log = logging.getLogger(__name__)
 log.setLevel(SRC_LOG_LEVELS["DB"])
 
 
+# A \u0000 escape not preceded by an escaped backslash, i.e. an encoded NUL character
+_JSON_NUL_ESCAPE_RE = re.compile(r"(?<!\\)((?:\\\\)*)\\u0000")
+
+
+# JSON (de)serializers for SQLAlchemy JSON columns. orjson is several times faster
+# than the stdlib; fall back to json for the few values it refuses (integers wider
+# than 64 bits, NaN/Infinity literals written by older json.dumps calls)
+def _json_serializer(value: Any) -> str:
+    try:
+        serialized = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError:
+        serialized = json.dumps(value)
+    # PostgreSQL jsonb (chat.chat) rejects NUL characters, so drop them from strings
+    if "\\u0000" in serialized:
+        serialized = _JSON_NUL_ESCAPE_RE.sub(r"\1", serialized)
+    return serialized
+
+
+def _json_deserializer(value: str | bytes) -> Any:
+    try:
+        return orjson.loads(value)
+    except orjson.JSONDecodeError:
+        return json.loads(value)
+
+
 class JSONField(types.TypeDecorator):
     impl = types.Text
     cache_ok = True
 
     def process_bind_param(self, value: Optional[_T], dialect: Dialect) -> Any:
-        return json.dumps(value)
+        return _json_serializer(value)
 
     def process_result_value(self, value: Optional[_T], dialect: Dialect) -> Any:
         if value is not None:
-            return json.loads(value)
+            return _json_deserializer(value)
 
     def copy(self, **kw: Any) -> Self:
         return JSONField(self.impl.length)
@@ -78,7 +105,10 @@ handle_peewee_migration(DATABASE_URL)
 SQLALCHEMY_DATABASE_URL = DATABASE_URL
 if "sqlite" in SQLALCHEMY_DATABASE_URL:
     engine = create_engine(
-        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        json_serializer=_json_serializer,
+        json_deserializer=_json_deserializer,
     )
 else:
     if DATABASE_POOL_SIZE > 0:
@@ -90,10 +120,16 @@ else:
             pool_recycle=DATABASE_POOL_RECYCLE,
             pool_pre_ping=True,
             poolclass=QueuePool,
+            json_serializer=_json_serializer,
+            json_deserializer=_json_deserializer,
         )
     else:
         engine = create_engine(
-            SQLALCHEMY_DATABASE_URL, pool_pre_ping=True, poolclass=NullPool
+            SQLALCHEMY_DATABASE_URL,
+            pool_pre_ping=True,
+            poolclass=NullPool,
+            json_serializer=_json_serializer,
+            json_deserializer=_json_deserializer,
         )
 
 
@@ -36,7 +36,7 @@ from fastapi import (
 from fastapi.openapi.docs import get_swagger_ui_html
 
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 
 from starlette.exceptions import HTTPException as StarletteHTTPException
@@ -92,6 +92,7 @@ from open_webui.models.functions import Functions
 from open_webui.models.models import Models
 from open_webui.models.users import UserModel, Users
 from open_webui.models.chats import Chats
+from open_webui.models.chat_messages import ChatMessages
 
 from open_webui.config import (
     LICENSE_KEY,
@@ -430,6 +431,18 @@ https://github.com/lumitry/vela-chat
 )
 
 
+async def periodic_metrics_rollup_partition_maintenance():
+    # Keep the monthly metrics_daily_rollup partitions created ahead of time. Rows for
+    # a month without a partition land in the default one until this catches up.
+    while True:
+        try:
+            await asyncio.to_thread(ChatMessages.ensure_metrics_rollup_partitions)
+        except Exception as e:
+            log.warning(f"Failed to create metrics rollup partitions: {e}")
+        # Partitions are created months ahead, so a weekly pass is plenty
+        await asyncio.sleep(7 * 24 * 60 * 60)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     start_logger()
@@ -440,6 +453,7 @@ async def lifespan(app: FastAPI):
         get_license_data(app, LICENSE_KEY)
 
     asyncio.create_task(periodic_usage_pool_cleanup())
+    asyncio.create_task(periodic_metrics_rollup_partition_maintenance())
     yield
 
 
@@ -449,6 +463,7 @@ app = FastAPI(
     openapi_url="/openapi.json",
     redoc_url=None,
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 oauth_manager = OAuthManager(app)
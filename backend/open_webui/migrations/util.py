@@ -1,5 +1,21 @@
+import importlib.util
+import json
+from pathlib import Path
+
 from alembic import op
-from sqlalchemy import Inspector
+from sqlalchemy import Inspector, text
+
+# orjson parses large string-encoded blobs several times faster; it is optional
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# maintenance_work_mem for VACUUM/CLUSTER run by migrations. VACUUM needs 6 bytes per
+# dead tuple, so this covers tens of millions of rewritten rows in one index pass.
+MAINTENANCE_WORK_MEM = "256MB"
 
 
 def get_existing_tables():
@@ -13,3 +29,77 @@ def get_revision_id():
     import uuid
 
     return str(uuid.uuid4()).replace("-", "")[:12]
+
+
+def load_migration_module(module_name: str):
+    # Revision files are not an importable package, so load them by path. Used by
+    # downgrades that reinstall objects exactly as an earlier revision defined them.
+    path = Path(__file__).parent / "versions" / f"{module_name}.py"
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def compact_table(table_name: str, mode: str) -> None:
+    # Rewrite a PostgreSQL table so space freed by bulk updates or dropped columns
+    # (including its TOAST data) goes back to the OS. mode is "full" (VACUUM FULL) or
+    # "cluster" (CLUSTER on the primary key); both hold an exclusive lock while they
+    # run. Runs in an autocommit block, which commits the migration's work so far.
+    size_query = text(f"SELECT pg_size_pretty(pg_total_relation_size('{table_name}'))")
+    size_before = op.get_bind().execute(size_query).scalar()
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        # Rebuilding the table's indexes sorts in maintenance_work_mem
+        bind.execute(text(f"SET maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'"))
+        try:
+            if mode == "full":
+                print(f"Running VACUUM FULL {table_name} (exclusive lock, rewrites the table)...")
+                bind.execute(text(f"VACUUM (FULL, ANALYZE) {table_name}"))
+            elif mode == "cluster":
+                pk_index = bind.execute(
+                    text(
+                        "SELECT indexrelid::regclass::text FROM pg_index"
+                        " WHERE indrelid = CAST(:table_name AS regclass) AND indisprimary"
+                    ),
+                    {"table_name": table_name},
+                ).scalar()
+                print(f"Running CLUSTER {table_name} USING {pk_index} (exclusive lock, rewrites the table)...")
+                bind.execute(text(f"CLUSTER {table_name} USING {pk_index}"))
+                bind.execute(text(f"ANALYZE {table_name}"))
+            else:
+                raise ValueError(f"Unknown compaction mode: {mode}")
+        finally:
+            bind.execute(text("RESET maintenance_work_mem"))
+
+    size_after = op.get_bind().execute(size_query).scalar()
+    print(f"{table_name} size (including TOAST and indexes): {size_before} -> {size_after}")
+
+
+def strip_chat_message_history(chat_json):
+    # Remove history.messages and messages from a chat blob, decoding string-encoded
+    # blobs first. Returns (status, value): ("updated", chat), ("unchanged", None),
+    # ("null", None), ("not_dict", None) or ("error", message). Lives here rather than
+    # in the revision file so process pool workers can import it by name.
+    if not chat_json:
+        return "null", None
+
+    if isinstance(chat_json, str):
+        try:
+            chat_json = _json_loads(chat_json)
+        except Exception as e:
+            return "error", str(e)
+
+    if not isinstance(chat_json, dict):
+        return "not_dict", None
+
+    updated = False
+    if isinstance(chat_json.get("history"), dict) and "messages" in chat_json["history"]:
+        del chat_json["history"]["messages"]
+        updated = True
+    if "messages" in chat_json:
+        del chat_json["messages"]
+        updated = True
+
+    return ("updated", chat_json) if updated else ("unchanged", None)
@@ -0,0 +1,54 @@
+"""store chat JSON blobs as jsonb
+
+Revision ID: convert_chat_to_jsonb
+Revises: partition_metrics_daily_rollup
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "convert_chat_to_jsonb"
+down_revision = "partition_metrics_daily_rollup"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """
+    Convert chat.chat from json (text) to jsonb.
+
+    jsonb is stored pre-parsed, so key removal/lookup (-, #-, ->, ?) works on the
+    binary form without re-parsing the whole blob, reads skip the parse step, and
+    the column becomes GIN-indexable. The ORM keeps mapping it as JSON.
+
+    jsonb rejects the \\u0000 escape that json accepts, so NUL characters are dropped
+    from existing blobs first (and from new writes by the JSON column serializer).
+
+    The rewrite takes an ACCESS EXCLUSIVE lock on chat for its duration.
+    """
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        return
+
+    # Strip \u0000 escapes (NUL characters in pasted or tool output) but keep an
+    # escaped backslash followed by a literal "u0000"
+    op.execute(
+        r"""
+        UPDATE chat
+        SET chat = regexp_replace(chat::text, '(?<!\\)((?:\\\\)*)\\u0000', '\1', 'g')::json
+        WHERE chat::text LIKE '%\\u0000%'
+        """
+    )
+    op.execute("ALTER TABLE chat ALTER COLUMN chat TYPE jsonb USING chat::jsonb")
+    op.execute("ANALYZE chat")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE chat ALTER COLUMN chat TYPE json USING chat::json")
@@ -86,7 +86,7 @@ def upgrade() -> None:
                     
                     -- Check if this is the first message from this chat for this day/model combo
                     -- Use epoch range check instead of DATE() function for index usage
-                    -- Check both model_id and selected_model_id separately for better index usage
+                    -- Match the effective model (selected_model_id for arena models, else model_id)
                     -- Only count assistant messages
                     SELECT NOT EXISTS (
                         SELECT 1 FROM chat_message cm
@@ -95,13 +95,7 @@ def upgrade() -> None:
                         AND cm.role != 'user'
                         AND cm.created_at >= v_day_start_epoch
                         AND cm.created_at <= v_day_end_epoch
-                        AND (
-                            (v_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                            OR (v_model_id IS NOT NULL AND (
-                                (cm.selected_model_id = v_model_id)
-                                OR (cm.selected_model_id IS NULL AND cm.model_id = v_model_id)
-                            ))
-                        )
+                        AND COALESCE(cm.selected_model_id, cm.model_id) = v_model_id
                     ) INTO v_is_new_chat_for_day;
                     
                     -- Insert or update rollup row incrementally
@@ -187,13 +181,7 @@ def upgrade() -> None:
                                 AND cm.role != 'user'
                                 AND cm.created_at >= v_day_start_epoch
                                 AND cm.created_at <= v_day_end_epoch
-                                AND (
-                                    (v_old_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                                    OR (v_old_model_id IS NOT NULL AND (
-                                        (cm.selected_model_id = v_old_model_id)
-                                        OR (cm.selected_model_id IS NULL AND cm.model_id = v_old_model_id)
-                                    ))
-                                )
+                                AND COALESCE(cm.selected_model_id, cm.model_id) = v_old_model_id
                             ) INTO v_was_last_message_for_chat;
                             
                             UPDATE metrics_daily_rollup
@@ -246,13 +234,7 @@ def upgrade() -> None:
                                 AND cm.role != 'user'
                                 AND cm.created_at >= v_old_day_start_epoch
                                 AND cm.created_at <= v_old_day_end_epoch
-                                AND (
-                                    (v_old_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                                    OR (v_old_model_id IS NOT NULL AND (
-                                        (cm.selected_model_id = v_old_model_id)
-                                        OR (cm.selected_model_id IS NULL AND cm.model_id = v_old_model_id)
-                                    ))
-                                )
+                                AND COALESCE(cm.selected_model_id, cm.model_id) = v_old_model_id
                             ) INTO v_was_last_message_for_chat;
                             
                             -- Decrement old rollup row incrementally
@@ -287,13 +269,7 @@ def upgrade() -> None:
                             AND cm.role != 'user'
                             AND cm.created_at >= v_day_start_epoch
                             AND cm.created_at <= v_day_end_epoch
-                            AND (
-                                (v_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                                OR (v_model_id IS NOT NULL AND (
-                                    (cm.selected_model_id = v_model_id)
-                                    OR (cm.selected_model_id IS NULL AND cm.model_id = v_model_id)
-                                ))
-                            )
+                            AND COALESCE(cm.selected_model_id, cm.model_id) = v_model_id
                         ) INTO v_is_new_chat_for_day;
                         
                         -- Increment new rollup row incrementally
@@ -380,7 +356,7 @@ def upgrade() -> None:
                     v_day_end_epoch := v_day_start_epoch + 86400 - 1;
                     
                     -- Check if this was the last message from this chat for this day/model combo
-                    -- Check both model_id and selected_model_id separately for better index usage
+                    -- Match the effective model (selected_model_id for arena models, else model_id)
                     -- Only count assistant messages
                     SELECT NOT EXISTS (
                         SELECT 1 FROM chat_message cm
@@ -389,13 +365,7 @@ def upgrade() -> None:
                         AND cm.role != 'user'
                         AND cm.created_at >= v_day_start_epoch
                         AND cm.created_at <= v_day_end_epoch
-                        AND (
-                            (v_old_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                            OR (v_old_model_id IS NOT NULL AND (
-                                (cm.selected_model_id = v_old_model_id)
-                                OR (cm.selected_model_id IS NULL AND cm.model_id = v_old_model_id)
-                            ))
-                        )
+                        AND COALESCE(cm.selected_model_id, cm.model_id) = v_old_model_id
                     ) INTO v_was_last_message_for_chat;
                     
                     -- Decrement rollup row incrementally
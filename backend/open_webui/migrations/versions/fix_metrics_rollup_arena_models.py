@@ -10,6 +10,8 @@ from alembic import op
 import sqlalchemy as sa
 from sqlalchemy import inspect
 
+from open_webui.migrations.util import load_migration_module
+
 
 # revision identifiers, used by Alembic.
 revision = 'fix_metrics_rollup_arena_models'
@@ -17,6 +19,11 @@ down_revision = 'add_daily_metrics_rollup'
 branch_labels = None
 depends_on = None
 
+# Number of days of messages aggregated per backfill transaction
+BACKFILL_CHUNK_DAYS = 1
+# Refresh rollup statistics every this many chunks while the table fills up
+BACKFILL_ANALYZE_EVERY = 20
+
 
 def upgrade() -> None:
     """
@@ -44,8 +51,26 @@ def upgrade() -> None:
     
     # Re-backfill with COALESCE(selected_model_id, model_id) logic
     # CRITICAL: Only include assistant messages (role != 'user') - user messages have no model/cost/tokens
+    # The backfill runs in chunks of whole days, each committed on its own, so large installs
+    # don't hold one long transaction (and one huge WAL burst) over all of chat_message.
+    # Chunk bounds are midnights in the session time zone - the same days DATE(to_timestamp())
+    # produces - so every rollup row is built by exactly one chunk and the per-chunk
+    # COUNT(DISTINCT chat_id) values are final.
     print("Re-backfilling metrics with arena model support (excluding user messages)...")
-    op.execute("""
+    backfill_range = sa.text("""
+        SELECT
+            EXTRACT(EPOCH FROM date_trunc('day', to_timestamp(MIN(created_at))))::bigint,
+            MAX(created_at)
+        FROM chat_message
+    """)
+    # Interval arithmetic on timestamptz keeps the bound on local midnight across DST changes
+    next_chunk_bound = sa.text("""
+        SELECT EXTRACT(EPOCH FROM to_timestamp(:lo) + make_interval(days => :chunk_days))::bigint
+    """)
+    # Every chunk runs the same INSERT ... SELECT, so it is prepared once on the
+    # backfill connection and executed per chunk instead of re-planned each time
+    prepare_backfill_chunk = sa.text("""
+        PREPARE metrics_backfill_chunk(bigint, bigint, bigint) AS
         INSERT INTO metrics_daily_rollup (
             id, user_id, date, model_id, message_count, total_cost,
             total_input_tokens, total_output_tokens, total_reasoning_tokens,
@@ -62,15 +87,63 @@ def upgrade() -> None:
             COALESCE(SUM(cm.output_tokens), 0) as total_output_tokens,
             COALESCE(SUM(cm.reasoning_tokens), 0) as total_reasoning_tokens,
             COUNT(DISTINCT cm.chat_id) as distinct_chat_count,
-            EXTRACT(EPOCH FROM NOW())::bigint as created_at,
-            EXTRACT(EPOCH FROM NOW())::bigint as updated_at
+            $3 as created_at,
+            $3 as updated_at
         FROM chat_message cm
         JOIN chat c ON cm.chat_id = c.id
-        WHERE cm.role != 'user'
+        WHERE cm.created_at >= $1 AND cm.created_at < $2
+        AND cm.role != 'user'
         AND COALESCE(cm.selected_model_id, cm.model_id) IS NOT NULL
         GROUP BY c.user_id, DATE(to_timestamp(cm.created_at)), COALESCE(cm.selected_model_id, cm.model_id)
-        ON CONFLICT (user_id, date, model_id) DO NOTHING
+        ON CONFLICT (user_id, date, model_id) DO UPDATE SET
+            message_count = metrics_daily_rollup.message_count + EXCLUDED.message_count,
+            total_cost = metrics_daily_rollup.total_cost + EXCLUDED.total_cost,
+            total_input_tokens = metrics_daily_rollup.total_input_tokens + EXCLUDED.total_input_tokens,
+            total_output_tokens = metrics_daily_rollup.total_output_tokens + EXCLUDED.total_output_tokens,
+            total_reasoning_tokens = metrics_daily_rollup.total_reasoning_tokens + EXCLUDED.total_reasoning_tokens,
+            distinct_chat_count = metrics_daily_rollup.distinct_chat_count + EXCLUDED.distinct_chat_count,
+            updated_at = EXCLUDED.updated_at
     """)
+    execute_backfill_chunk = sa.text("EXECUTE metrics_backfill_chunk(:lo, :hi, :now)")
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        # chat_message is written roughly in created_at order, so a BRIN index (a few
+        # pages even for millions of rows) lets each day chunk read just its stretch of
+        # the heap. It only serves the backfill and is dropped again afterwards.
+        conn.execute(sa.text("DROP INDEX CONCURRENTLY IF EXISTS idx_chat_message_created_at_brin"))
+        conn.execute(sa.text("""
+            CREATE INDEX CONCURRENTLY idx_chat_message_created_at_brin
+            ON chat_message USING BRIN (created_at) WITH (pages_per_range = 128)
+        """))
+        # The planner costs BRIN scans from created_at's physical correlation
+        conn.execute(sa.text("ANALYZE chat_message"))
+        conn.execute(prepare_backfill_chunk)
+        try:
+            # One timestamp for the whole backfill rather than per row and per chunk
+            now = conn.execute(sa.text("SELECT EXTRACT(EPOCH FROM NOW())::bigint")).scalar()
+            lo, last_created_at = conn.execute(backfill_range).one()
+            chunk_count = 0
+            while lo is not None and lo <= last_created_at:
+                hi = conn.execute(next_chunk_bound, {"lo": lo, "chunk_days": BACKFILL_CHUNK_DAYS}).scalar()
+                conn.execute(execute_backfill_chunk, {"lo": lo, "hi": hi, "now": now})
+                chunk_count += 1
+                lo = hi
+                # Chunks commit one by one, so keep the rollup's statistics in step with
+                # it instead of leaving it looking empty until the final ANALYZE
+                if chunk_count % BACKFILL_ANALYZE_EVERY == 0:
+                    conn.execute(sa.text("ANALYZE metrics_daily_rollup"))
+        finally:
+            conn.execute(sa.text("DEALLOCATE metrics_backfill_chunk"))
+            conn.execute(sa.text("DROP INDEX CONCURRENTLY IF EXISTS idx_chat_message_created_at_brin"))
+    print(f"Re-backfilled metrics in {chunk_count} chunk(s)")
+    
+    # Chunks land in date order, interleaving every user's rows across the heap.
+    # Rewrite the (small) rollup table in (user_id, date, model_id) order so the
+    # per-user date-range dashboard queries read adjacent pages. CLUSTER holds an
+    # exclusive lock while it runs; to re-cluster a live install later without
+    # blocking, use pg_repack -t metrics_daily_rollup -o user_id,date,model_id.
+    print("Clustering rollup table by user and date...")
+    op.execute("CLUSTER metrics_daily_rollup USING uq_metrics_daily_rollup_user_date_model")
     
     # Recreate trigger function with arena model support
     print("Recreating trigger function with arena model support...")
@@ -93,6 +166,12 @@ def upgrade() -> None:
             v_old_day_start_epoch BIGINT;
             v_old_day_end_epoch BIGINT;
         BEGIN
+            -- Bulk loaders (backfills, imports) can SET LOCAL open_webui.skip_metrics_rollup = 'on'
+            -- to bypass rollup maintenance and rebuild the affected days afterwards
+            IF current_setting('open_webui.skip_metrics_rollup', true) = 'on' THEN
+                RETURN COALESCE(NEW, OLD);
+            END IF;
+
             -- Handle INSERT
             IF TG_OP = 'INSERT' THEN
                 -- Skip user messages - they have no model/cost/tokens
@@ -122,7 +201,7 @@ def upgrade() -> None:
                 
                 -- Check if this is the first message from this chat for this day/model combo
                 -- Use epoch range check instead of DATE() function for index usage
-                -- Check both model_id and selected_model_id separately for better index usage
+                -- Match the effective model (selected_model_id for arena models, else model_id)
                 -- Only count assistant messages
                 SELECT NOT EXISTS (
                     SELECT 1 FROM chat_message cm
@@ -131,13 +210,7 @@ def upgrade() -> None:
                     AND cm.role != 'user'
                     AND cm.created_at >= v_day_start_epoch
                     AND cm.created_at <= v_day_end_epoch
-                    AND (
-                        (v_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                        OR (v_model_id IS NOT NULL AND (
-                            (cm.selected_model_id = v_model_id)
-                            OR (cm.selected_model_id IS NULL AND cm.model_id = v_model_id)
-                        ))
-                    )
+                    AND COALESCE(cm.selected_model_id, cm.model_id) = v_model_id
                 ) INTO v_is_new_chat_for_day;
                 
                 -- Insert or update rollup row incrementally
@@ -212,13 +285,7 @@ def upgrade() -> None:
                             AND cm.role != 'user'
                             AND cm.created_at >= v_day_start_epoch
                             AND cm.created_at <= v_day_end_epoch
-                            AND (
-                                (v_old_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                                OR (v_old_model_id IS NOT NULL AND (
-                                    (cm.selected_model_id = v_old_model_id)
-                                    OR (cm.selected_model_id IS NULL AND cm.model_id = v_old_model_id)
-                                ))
-                            )
+                            AND COALESCE(cm.selected_model_id, cm.model_id) = v_old_model_id
                         ) INTO v_was_last_message_for_chat;
                         
                         UPDATE metrics_daily_rollup
@@ -261,7 +328,7 @@ def upgrade() -> None:
                     v_day_end_epoch := v_day_start_epoch + 86400 - 1;
                     
                     -- Check if OLD was the last message from this chat for the old day/model combo
-                    -- Check both model_id and selected_model_id separately for better index usage
+                    -- Match the effective model (selected_model_id for arena models, else model_id)
                     -- Only count assistant messages
                     SELECT NOT EXISTS (
                         SELECT 1 FROM chat_message cm
@@ -270,13 +337,7 @@ def upgrade() -> None:
                         AND cm.role != 'user'
                         AND cm.created_at >= v_old_day_start_epoch
                         AND cm.created_at <= v_old_day_end_epoch
-                        AND (
-                            (v_old_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                            OR (v_old_model_id IS NOT NULL AND (
-                                (cm.selected_model_id = v_old_model_id)
-                                OR (cm.selected_model_id IS NULL AND cm.model_id = v_old_model_id)
-                            ))
-                        )
+                        AND COALESCE(cm.selected_model_id, cm.model_id) = v_old_model_id
                     ) INTO v_was_last_message_for_chat;
                     
                     -- Decrement old rollup row incrementally
@@ -304,7 +365,7 @@ def upgrade() -> None:
                     END IF;
                     
                     -- Check if NEW is the first message from this chat for the new day/model combo
-                    -- Check both model_id and selected_model_id separately for better index usage
+                    -- Match the effective model (selected_model_id for arena models, else model_id)
                     -- Only count assistant messages
                     SELECT NOT EXISTS (
                         SELECT 1 FROM chat_message cm
@@ -313,13 +374,7 @@ def upgrade() -> None:
                         AND cm.role != 'user'
                         AND cm.created_at >= v_day_start_epoch
                         AND cm.created_at <= v_day_end_epoch
-                        AND (
-                            (v_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                            OR (v_model_id IS NOT NULL AND (
-                                (cm.selected_model_id = v_model_id)
-                                OR (cm.selected_model_id IS NULL AND cm.model_id = v_model_id)
-                            ))
-                        )
+                        AND COALESCE(cm.selected_model_id, cm.model_id) = v_model_id
                     ) INTO v_is_new_chat_for_day;
                     
                     -- Increment new rollup row incrementally
@@ -399,7 +454,7 @@ def upgrade() -> None:
                 v_day_end_epoch := v_day_start_epoch + 86400 - 1;
                 
                 -- Check if this was the last message from this chat for this day/model combo
-                -- Check both model_id and selected_model_id separately for better index usage
+                -- Match the effective model (selected_model_id for arena models, else model_id)
                 -- Only count assistant messages
                 SELECT NOT EXISTS (
                     SELECT 1 FROM chat_message cm
@@ -408,13 +463,7 @@ def upgrade() -> None:
                     AND cm.role != 'user'
                     AND cm.created_at >= v_day_start_epoch
                     AND cm.created_at <= v_day_end_epoch
-                    AND (
-                        (v_old_model_id IS NULL AND cm.model_id IS NULL AND cm.selected_model_id IS NULL)
-                        OR (v_old_model_id IS NOT NULL AND (
-                            (cm.selected_model_id = v_old_model_id)
-                            OR (cm.selected_model_id IS NULL AND cm.model_id = v_old_model_id)
-                        ))
-                    )
+                    AND COALESCE(cm.selected_model_id, cm.model_id) = v_old_model_id
                 ) INTO v_was_last_message_for_chat;
                 
                 -- Decrement rollup row incrementally
@@ -479,13 +528,19 @@ def upgrade() -> None:
         EXECUTE FUNCTION update_metrics_daily_rollup();
     """)
     
-    # Update index to include selected_model_id and role for better EXISTS query performance
+    # Update index to include selected_model_id for better EXISTS query performance
+    # The EXISTS checks only ever look at non-user messages, so leave user rows
+    # (roughly half of chat_message) out of the index entirely
+    # Built CONCURRENTLY outside the migration transaction, after the backfill, so
+    # writes to chat_message are not blocked for the duration of the build
     print("Updating index to support selected_model_id lookups...")
-    op.execute("DROP INDEX IF EXISTS idx_chat_message_chatid_createdat_model_role")
-    op.execute("""
-        CREATE INDEX idx_chat_message_chatid_createdat_model_role 
-        ON chat_message (chat_id, created_at, model_id, selected_model_id, role)
-    """)
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_chat_message_chatid_createdat_model_role")
+        op.execute("""
+            CREATE INDEX CONCURRENTLY idx_chat_message_chatid_createdat_model_role 
+            ON chat_message (chat_id, created_at, model_id, selected_model_id)
+            WHERE role <> 'user'
+        """)
     
     # Analyze tables
     op.execute("ANALYZE metrics_daily_rollup")
@@ -497,7 +552,8 @@ def upgrade() -> None:
 def downgrade() -> None:
     """
     Revert to previous version (without arena model support).
-    Note: This will lose the corrected arena model data.
+    The previous trigger function and triggers are reinstalled in place and the
+    rollup data is kept, so dashboards keep working without a re-backfill.
     """
     conn = op.get_bind()
     dialect_name = conn.dialect.name
@@ -505,13 +561,10 @@ def downgrade() -> None:
     if dialect_name != 'postgresql':
         return
     
-    # Drop triggers
-    op.execute("DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_delete ON chat_message")
-    op.execute("DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_update ON chat_message")
-    op.execute("DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_insert ON chat_message")
-    
-    # Drop function
-    op.execute("DROP FUNCTION IF EXISTS update_metrics_daily_rollup()")
+    # Swap the previous function and triggers back in instead of dropping them.
+    # Existing rows stay; new arena-model messages are attributed to the arena
+    # model_id again until the next upgrade re-backfills.
+    load_migration_module("add_daily_metrics_rollup").install_metrics_rollup_trigger()
     
     # Recreate original index
     op.execute("DROP INDEX IF EXISTS idx_chat_message_chatid_createdat_model_role")
@@ -520,6 +573,4 @@ def downgrade() -> None:
         ON chat_message (chat_id, created_at, model_id, role)
     """)
     
-    # Note: We don't re-backfill here since downgrade should be rare
-    # The rollup table will be empty until next upgrade
 
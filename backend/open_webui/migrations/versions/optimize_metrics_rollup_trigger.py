@@ -0,0 +1,821 @@
+"""optimize metrics rollup trigger function
+
+Revision ID: optimize_metrics_rollup_trigger
+Revises: skip_metrics_rollup_realtime
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+from alembic import op
+
+from open_webui.migrations.util import load_migration_module
+
+
+# revision identifiers, used by Alembic.
+revision = "optimize_metrics_rollup_trigger"
+down_revision = "skip_metrics_rollup_realtime"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """
+    Replace update_metrics_daily_rollup() with a version whose decrement paths
+    read the remaining message_count back via RETURNING and only issue the
+    DELETE when the rollup row actually became empty. Previously every decrement
+    paid for an UPDATE followed by an unconditional DELETE ... WHERE message_count = 0.
+    (Folding both into one WITH ... UPDATE ... DELETE statement does not work: the
+    DELETE cannot see a row the same statement has already updated.)
+
+    The md5 surrogate id is dropped in favour of a (user_id, date, model_id)
+    primary key, so trigger inserts no longer hash a key per row. UPDATEs look
+    the owning chat up once instead of up to four times.
+
+    distinct_chat_count is driven by a chat_day_model_count side table instead of
+    EXISTS range scans over chat_message, so the chat_message index that served
+    those scans is dropped. INSERT and DELETE triggers run once per
+    statement over transition tables. UPDATEs stay row-level, split between the full
+    function for re-keying changes and a single-UPDATE fast path for token/cost edits.
+
+    Every trigger function also honours the open_webui.skip_metrics_rollup setting
+    itself, so bulk loaders can reuse the knob even on triggers created without the
+    WHEN guard. The guard stays in WHEN as well: it is checked before the function
+    is called, so skipped rows (streaming saves) never pay for a PL/pgSQL call.
+    """
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        return
+
+    # The md5(user_id|date|model_id) surrogate key duplicated the unique
+    # (user_id, date, model_id) constraint and cost a string concat + hash per
+    # trigger fire. Promote the natural key to primary key and drop both.
+    # Rows without a model are never written on PostgreSQL (the triggers skip them),
+    # so the NOT NULL needed for the primary key only clears legacy leftovers.
+    op.execute("DELETE FROM metrics_daily_rollup WHERE model_id IS NULL")
+    op.execute(
+        """
+        ALTER TABLE metrics_daily_rollup
+            DROP COLUMN id,
+            DROP CONSTRAINT uq_metrics_daily_rollup_user_date_model,
+            ALTER COLUMN model_id SET NOT NULL,
+            ADD CONSTRAINT metrics_daily_rollup_pkey PRIMARY KEY (user_id, date, model_id)
+        """
+    )
+    # Keep a later plain `CLUSTER metrics_daily_rollup` ordering rows by user and date
+    # now that the unique constraint it was clustered on is gone
+    op.execute("ALTER TABLE metrics_daily_rollup CLUSTER ON metrics_daily_rollup_pkey")
+
+    # The model a message is attributed to: selected_model_id for arena models, else
+    # model_id. A single-expression IMMUTABLE SQL function is inlined by the planner,
+    # so it costs nothing over writing the COALESCE out. It deliberately has no
+    # SET search_path clause, which would force a real call (and GUC save/restore).
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION effective_model_id(selected_model_id TEXT, model_id TEXT)
+        RETURNS TEXT
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE
+        AS $$ SELECT COALESCE(selected_model_id, model_id) $$
+        """
+    )
+
+    # distinct_chat_count used to be maintained by probing chat_message with an
+    # EXISTS range scan on every fire (twice for re-keying UPDATEs). Keep a
+    # per-(chat, day, model) message counter instead: a chat enters or leaves
+    # distinct_chat_count exactly when its counter moves between 0 and 1.
+    op.execute(
+        """
+        CREATE TABLE chat_day_model_count (
+            chat_id TEXT NOT NULL,
+            date DATE NOT NULL,
+            model_id TEXT NOT NULL,
+            msg_count INTEGER NOT NULL,
+            CONSTRAINT chat_day_model_count_pkey PRIMARY KEY (chat_id, date, model_id)
+        )
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO chat_day_model_count (chat_id, date, model_id, msg_count)
+        SELECT
+            cm.chat_id,
+            DATE(to_timestamp(cm.created_at)),
+            effective_model_id(cm.selected_model_id, cm.model_id),
+            COUNT(*)
+        FROM chat_message cm
+        JOIN chat c ON c.id = cm.chat_id
+        WHERE cm.role != 'user'
+        AND effective_model_id(cm.selected_model_id, cm.model_id) IS NOT NULL
+        AND COALESCE((c.meta->>'imported')::boolean, false) = false
+        GROUP BY 1, 2, 3
+        """
+    )
+
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION update_metrics_daily_rollup()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            v_user_id TEXT;
+            v_date DATE;
+            v_model_id TEXT;
+            v_old_user_id TEXT;
+            v_old_date DATE;
+            v_old_model_id TEXT;
+            v_date_changed BOOLEAN;
+            v_model_changed BOOLEAN;
+            v_is_new_chat_for_day BOOLEAN;
+            v_was_last_message_for_chat BOOLEAN;
+            v_chat_imported BOOLEAN;
+            v_old_chat_imported BOOLEAN;
+            v_remaining_count INTEGER;
+            v_now_epoch BIGINT;
+        BEGIN
+            -- Bulk loaders (backfills, imports) can SET LOCAL open_webui.skip_metrics_rollup = 'on'
+            -- to bypass rollup maintenance, regardless of how the triggers themselves are defined
+            IF current_setting('open_webui.skip_metrics_rollup', true) = 'on' THEN
+                RETURN COALESCE(NEW, OLD);
+            END IF;
+
+            -- NOW() is fixed for the transaction; convert it once for every timestamp below
+            v_now_epoch := EXTRACT(EPOCH FROM NOW())::bigint;
+
+            -- Handle INSERT
+            IF TG_OP = 'INSERT' THEN
+                -- Skip user messages - they have no model/cost/tokens
+                IF NEW.role = 'user' THEN
+                    RETURN NEW;
+                END IF;
+                
+                -- Get user_id and check if chat is imported
+                SELECT user_id, COALESCE((meta->>'imported')::boolean, false) INTO v_user_id, v_chat_imported 
+                FROM chat WHERE id = NEW.chat_id;
+                
+                IF v_user_id IS NULL THEN
+                    RETURN NEW;
+                END IF;
+                
+                -- Skip imported chats - they should not affect metrics
+                IF v_chat_imported = true THEN
+                    RETURN NEW;
+                END IF;
+                
+                -- Calculate date from timestamp
+                v_date := DATE(to_timestamp(NEW.created_at));
+                -- Use selected_model_id if present, otherwise model_id (for arena models)
+                v_model_id := effective_model_id(NEW.selected_model_id, NEW.model_id);
+                
+                -- Skip if no model_id (shouldn't happen for assistant messages, but be safe)
+                IF v_model_id IS NULL THEN
+                    RETURN NEW;
+                END IF;
+                
+                -- Count this message against its chat/day/model; the chat is new for the
+                -- day when its counter was just created
+                INSERT INTO chat_day_model_count (chat_id, date, model_id, msg_count)
+                VALUES (NEW.chat_id, v_date, v_model_id, 1)
+                ON CONFLICT (chat_id, date, model_id) DO UPDATE SET
+                    msg_count = chat_day_model_count.msg_count + 1
+                RETURNING msg_count = 1 INTO v_is_new_chat_for_day;
+                
+                -- Insert or update rollup row incrementally
+                INSERT INTO metrics_daily_rollup (
+                    user_id, date, model_id, message_count, total_cost,
+                    total_input_tokens, total_output_tokens, total_reasoning_tokens,
+                    distinct_chat_count, created_at, updated_at
+                )
+                VALUES (
+                    v_user_id,
+                    v_date,
+                    v_model_id,
+                    1,
+                    COALESCE(NEW.cost, 0),
+                    COALESCE(NEW.input_tokens, 0),
+                    COALESCE(NEW.output_tokens, 0),
+                    COALESCE(NEW.reasoning_tokens, 0),
+                    CASE WHEN v_is_new_chat_for_day THEN 1 ELSE 0 END,
+                    v_now_epoch,
+                    v_now_epoch
+                )
+                ON CONFLICT (user_id, date, model_id) DO UPDATE SET
+                    message_count = metrics_daily_rollup.message_count + 1,
+                    total_cost = metrics_daily_rollup.total_cost + COALESCE(NEW.cost, 0),
+                    total_input_tokens = metrics_daily_rollup.total_input_tokens + COALESCE(NEW.input_tokens, 0),
+                    total_output_tokens = metrics_daily_rollup.total_output_tokens + COALESCE(NEW.output_tokens, 0),
+                    total_reasoning_tokens = metrics_daily_rollup.total_reasoning_tokens + COALESCE(NEW.reasoning_tokens, 0),
+                    distinct_chat_count = metrics_daily_rollup.distinct_chat_count + 
+                        CASE WHEN v_is_new_chat_for_day THEN 1 ELSE 0 END,
+                    updated_at = v_now_epoch;
+            END IF;
+            
+            -- Handle UPDATE
+            IF TG_OP = 'UPDATE' THEN
+                -- Skip user messages - they have no model/cost/tokens
+                -- If role changed from assistant to user, remove from rollup
+                -- If role changed from user to assistant, add to rollup
+                IF NEW.role = 'user' AND OLD.role != 'user' THEN
+                    -- Role changed to user - remove from rollup (handle as DELETE)
+                    -- Fall through to DELETE logic below
+                ELSIF NEW.role = 'user' THEN
+                    -- Already a user message, skip
+                    RETURN NEW;
+                END IF;
+                
+                -- Get user_ids and check if chats are imported
+                -- A message practically never moves between chats, so look the chat up
+                -- once and only pay for a second lookup when chat_id actually changed
+                SELECT user_id, COALESCE((meta->>'imported')::boolean, false) INTO v_user_id, v_chat_imported 
+                FROM chat WHERE id = NEW.chat_id;
+                IF OLD.chat_id = NEW.chat_id THEN
+                    v_old_user_id := v_user_id;
+                    v_old_chat_imported := v_chat_imported;
+                ELSE
+                    SELECT user_id, COALESCE((meta->>'imported')::boolean, false) INTO v_old_user_id, v_old_chat_imported 
+                    FROM chat WHERE id = OLD.chat_id;
+                END IF;
+                
+                -- If new chat is imported, skip (don't add to metrics)
+                -- But we still need to handle removal from old date if chat became imported
+                IF v_chat_imported = true AND (OLD.role != 'user' OR OLD.role IS NULL) THEN
+                    -- Chat is now imported, but was not before - remove from old metrics
+                    -- This handles the case where a chat is marked as imported after creation
+                    -- For now, we'll skip the update - imported chats shouldn't be updated anyway
+                    RETURN NEW;
+                END IF;
+                
+                -- Calculate dates from timestamps
+                v_date := DATE(to_timestamp(NEW.created_at));
+                v_old_date := DATE(to_timestamp(OLD.created_at));
+                -- Use selected_model_id if present, otherwise model_id (for arena models)
+                v_model_id := effective_model_id(NEW.selected_model_id, NEW.model_id);
+                v_old_model_id := effective_model_id(OLD.selected_model_id, OLD.model_id);
+                
+                -- Handle role change from assistant to user
+                IF NEW.role = 'user' AND OLD.role != 'user' THEN
+                    -- Treat as DELETE for the old assistant message
+                    -- Only remove if old chat was not imported
+                    IF v_old_user_id IS NOT NULL AND v_old_model_id IS NOT NULL AND v_old_chat_imported != true THEN
+                        -- Decrement this chat's counter for the day/model; the chat leaves
+                        -- distinct_chat_count once its counter reaches zero
+                        UPDATE chat_day_model_count
+                        SET msg_count = msg_count - 1
+                        WHERE chat_id = OLD.chat_id AND date = v_old_date AND model_id = v_old_model_id
+                        RETURNING msg_count = 0 INTO v_was_last_message_for_chat;
+                        IF v_was_last_message_for_chat THEN
+                            DELETE FROM chat_day_model_count
+                            WHERE chat_id = OLD.chat_id AND date = v_old_date AND model_id = v_old_model_id;
+                        END IF;
+                        -- No counter row means no other message of this chat is tracked for the day
+                        v_was_last_message_for_chat := COALESCE(v_was_last_message_for_chat, true);
+                        
+                        UPDATE metrics_daily_rollup
+                        SET
+                            message_count = GREATEST(0, message_count - 1),
+                            total_cost = GREATEST(0, total_cost - COALESCE(OLD.cost, 0)),
+                            total_input_tokens = GREATEST(0, total_input_tokens - COALESCE(OLD.input_tokens, 0)),
+                            total_output_tokens = GREATEST(0, total_output_tokens - COALESCE(OLD.output_tokens, 0)),
+                            total_reasoning_tokens = GREATEST(0, total_reasoning_tokens - COALESCE(OLD.reasoning_tokens, 0)),
+                            distinct_chat_count = GREATEST(0, distinct_chat_count - 
+                                CASE WHEN v_was_last_message_for_chat THEN 1 ELSE 0 END),
+                            updated_at = v_now_epoch
+                        WHERE user_id = v_old_user_id
+                        AND date = v_old_date
+                        AND model_id = v_old_model_id
+                        RETURNING message_count INTO v_remaining_count;
+
+                        -- Delete rollup row only when the decrement emptied it
+                        IF v_remaining_count = 0 THEN
+                            DELETE FROM metrics_daily_rollup
+                            WHERE user_id = v_old_user_id
+                            AND date = v_old_date
+                            AND model_id = v_old_model_id;
+                        END IF;
+                    END IF;
+                    RETURN NEW;
+                END IF;
+                
+                -- Skip if no model_id for new message
+                IF v_model_id IS NULL THEN
+                    RETURN NEW;
+                END IF;
+                
+                v_date_changed := (v_date != v_old_date);
+                v_model_changed := (v_model_id IS DISTINCT FROM v_old_model_id);
+                
+                -- If date or model_id changed, we need to update both old and new rollup rows
+                IF v_date_changed OR v_model_changed THEN
+                    -- Only remove if old chat was not imported
+                    IF v_old_user_id IS NOT NULL AND v_old_chat_imported != true THEN
+                        -- Decrement this chat's counter for the day/model; the chat leaves
+                        -- distinct_chat_count once its counter reaches zero
+                        UPDATE chat_day_model_count
+                        SET msg_count = msg_count - 1
+                        WHERE chat_id = OLD.chat_id AND date = v_old_date AND model_id = v_old_model_id
+                        RETURNING msg_count = 0 INTO v_was_last_message_for_chat;
+                        IF v_was_last_message_for_chat THEN
+                            DELETE FROM chat_day_model_count
+                            WHERE chat_id = OLD.chat_id AND date = v_old_date AND model_id = v_old_model_id;
+                        END IF;
+                        -- No counter row means no other message of this chat is tracked for the day
+                        v_was_last_message_for_chat := COALESCE(v_was_last_message_for_chat, true);
+                        
+                        -- Decrement old rollup row incrementally
+                        UPDATE metrics_daily_rollup
+                        SET
+                            message_count = GREATEST(0, message_count - 1),
+                            total_cost = GREATEST(0, total_cost - COALESCE(OLD.cost, 0)),
+                            total_input_tokens = GREATEST(0, total_input_tokens - COALESCE(OLD.input_tokens, 0)),
+                            total_output_tokens = GREATEST(0, total_output_tokens - COALESCE(OLD.output_tokens, 0)),
+                            total_reasoning_tokens = GREATEST(0, total_reasoning_tokens - COALESCE(OLD.reasoning_tokens, 0)),
+                            distinct_chat_count = GREATEST(0, distinct_chat_count - 
+                                CASE WHEN v_was_last_message_for_chat THEN 1 ELSE 0 END),
+                            updated_at = v_now_epoch
+                        WHERE user_id = v_old_user_id
+                        AND date = v_old_date
+                        AND model_id = v_old_model_id
+                        RETURNING message_count INTO v_remaining_count;
+
+                        -- Delete rollup row only when the decrement emptied it
+                        IF v_remaining_count = 0 THEN
+                            DELETE FROM metrics_daily_rollup
+                            WHERE user_id = v_old_user_id
+                            AND date = v_old_date
+                            AND model_id = v_old_model_id;
+                        END IF;
+                    END IF;
+                    
+                    -- Increment new rollup row incrementally
+                    IF v_user_id IS NOT NULL THEN
+                        -- Count this message against its chat/day/model; the chat is new for the
+                        -- day when its counter was just created
+                        INSERT INTO chat_day_model_count (chat_id, date, model_id, msg_count)
+                        VALUES (NEW.chat_id, v_date, v_model_id, 1)
+                        ON CONFLICT (chat_id, date, model_id) DO UPDATE SET
+                            msg_count = chat_day_model_count.msg_count + 1
+                        RETURNING msg_count = 1 INTO v_is_new_chat_for_day;
+
+                        INSERT INTO metrics_daily_rollup (
+                            user_id, date, model_id, message_count, total_cost,
+                            total_input_tokens, total_output_tokens, total_reasoning_tokens,
+                            distinct_chat_count, created_at, updated_at
+                        )
+                        VALUES (
+                            v_user_id,
+                            v_date,
+                            v_model_id,
+                            1,
+                            COALESCE(NEW.cost, 0),
+                            COALESCE(NEW.input_tokens, 0),
+                            COALESCE(NEW.output_tokens, 0),
+                            COALESCE(NEW.reasoning_tokens, 0),
+                            CASE WHEN v_is_new_chat_for_day THEN 1 ELSE 0 END,
+                            v_now_epoch,
+                            v_now_epoch
+                        )
+                        ON CONFLICT (user_id, date, model_id) DO UPDATE SET
+                            message_count = metrics_daily_rollup.message_count + 1,
+                            total_cost = metrics_daily_rollup.total_cost + COALESCE(NEW.cost, 0),
+                            total_input_tokens = metrics_daily_rollup.total_input_tokens + COALESCE(NEW.input_tokens, 0),
+                            total_output_tokens = metrics_daily_rollup.total_output_tokens + COALESCE(NEW.output_tokens, 0),
+                            total_reasoning_tokens = metrics_daily_rollup.total_reasoning_tokens + COALESCE(NEW.reasoning_tokens, 0),
+                            distinct_chat_count = metrics_daily_rollup.distinct_chat_count + 
+                                CASE WHEN v_is_new_chat_for_day THEN 1 ELSE 0 END,
+                            updated_at = v_now_epoch;
+                    END IF;
+                ELSE
+                    -- Date and model_id didn't change, just update the metrics values incrementally
+                    IF v_user_id IS NOT NULL THEN
+                        UPDATE metrics_daily_rollup
+                        SET
+                            -- Adjust differences: subtract OLD values, add NEW values
+                            total_cost = metrics_daily_rollup.total_cost - COALESCE(OLD.cost, 0) + COALESCE(NEW.cost, 0),
+                            total_input_tokens = metrics_daily_rollup.total_input_tokens - COALESCE(OLD.input_tokens, 0) + COALESCE(NEW.input_tokens, 0),
+                            total_output_tokens = metrics_daily_rollup.total_output_tokens - COALESCE(OLD.output_tokens, 0) + COALESCE(NEW.output_tokens, 0),
+                            total_reasoning_tokens = metrics_daily_rollup.total_reasoning_tokens - COALESCE(OLD.reasoning_tokens, 0) + COALESCE(NEW.reasoning_tokens, 0),
+                            updated_at = v_now_epoch
+                        WHERE user_id = v_user_id
+                        AND date = v_date
+                        AND model_id = v_model_id;
+                    END IF;
+                END IF;
+            END IF;
+            
+            -- Handle DELETE
+            IF TG_OP = 'DELETE' THEN
+                -- Skip user messages - they shouldn't be in rollup anyway
+                IF OLD.role = 'user' THEN
+                    RETURN OLD;
+                END IF;
+                
+                -- Get user_id and check if chat is imported
+                SELECT user_id, COALESCE((meta->>'imported')::boolean, false) INTO v_old_user_id, v_chat_imported 
+                FROM chat WHERE id = OLD.chat_id;
+                
+                IF v_old_user_id IS NULL THEN
+                    RETURN OLD;
+                END IF;
+                
+                -- Skip if chat was imported - it shouldn't be in rollup anyway
+                IF v_chat_imported = true THEN
+                    RETURN OLD;
+                END IF;
+                
+                -- Calculate date from timestamp
+                v_old_date := DATE(to_timestamp(OLD.created_at));
+                -- Use selected_model_id if present, otherwise model_id (for arena models)
+                v_old_model_id := effective_model_id(OLD.selected_model_id, OLD.model_id);
+                
+                -- Skip if no model_id
+                IF v_old_model_id IS NULL THEN
+                    RETURN OLD;
+                END IF;
+                
+                -- Decrement this chat's counter for the day/model; the chat leaves
+                -- distinct_chat_count once its counter reaches zero
+                UPDATE chat_day_model_count
+                SET msg_count = msg_count - 1
+                WHERE chat_id = OLD.chat_id AND date = v_old_date AND model_id = v_old_model_id
+                RETURNING msg_count = 0 INTO v_was_last_message_for_chat;
+                IF v_was_last_message_for_chat THEN
+                    DELETE FROM chat_day_model_count
+                    WHERE chat_id = OLD.chat_id AND date = v_old_date AND model_id = v_old_model_id;
+                END IF;
+                -- No counter row means no other message of this chat is tracked for the day
+                v_was_last_message_for_chat := COALESCE(v_was_last_message_for_chat, true);
+                
+                -- Decrement rollup row incrementally
+                UPDATE metrics_daily_rollup
+                SET
+                    message_count = GREATEST(0, message_count - 1),
+                    total_cost = GREATEST(0, total_cost - COALESCE(OLD.cost, 0)),
+                    total_input_tokens = GREATEST(0, total_input_tokens - COALESCE(OLD.input_tokens, 0)),
+                    total_output_tokens = GREATEST(0, total_output_tokens - COALESCE(OLD.output_tokens, 0)),
+                    total_reasoning_tokens = GREATEST(0, total_reasoning_tokens - COALESCE(OLD.reasoning_tokens, 0)),
+                    distinct_chat_count = GREATEST(0, distinct_chat_count - 
+                        CASE WHEN v_was_last_message_for_chat THEN 1 ELSE 0 END),
+                    updated_at = v_now_epoch
+                WHERE user_id = v_old_user_id
+                AND date = v_old_date
+                AND model_id = v_old_model_id
+                RETURNING message_count INTO v_remaining_count;
+
+                -- Delete rollup row only when the decrement emptied it
+                IF v_remaining_count = 0 THEN
+                    DELETE FROM metrics_daily_rollup
+                    WHERE user_id = v_old_user_id
+                    AND date = v_old_date
+                    AND model_id = v_old_model_id;
+                END IF;
+            END IF;
+            
+            RETURN COALESCE(NEW, OLD);
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+    )
+
+    # Row-level INSERT/DELETE triggers ran the plpgsql body once per message, so a
+    # bulk insert or a whole-chat delete paid one chat lookup and two upserts per row.
+    # Statement-level triggers see every affected row through a transition table and
+    # fold them into one grouped write per (chat, day, model) counter and rollup row.
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION update_metrics_daily_rollup_insert_batch()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            v_now_epoch BIGINT := EXTRACT(EPOCH FROM NOW())::bigint;
+        BEGIN
+            IF current_setting('open_webui.skip_metrics_rollup', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+
+            WITH per_chat AS (
+                -- Tracked messages only: no user messages, no model-less rows, no imported chats
+                SELECT
+                    c.user_id,
+                    n.chat_id,
+                    DATE(to_timestamp(n.created_at)) AS date,
+                    effective_model_id(n.selected_model_id, n.model_id) AS model_id,
+                    COUNT(*) AS message_count,
+                    SUM(COALESCE(n.cost, 0)) AS total_cost,
+                    SUM(COALESCE(n.input_tokens, 0)) AS total_input_tokens,
+                    SUM(COALESCE(n.output_tokens, 0)) AS total_output_tokens,
+                    SUM(COALESCE(n.reasoning_tokens, 0)) AS total_reasoning_tokens
+                FROM new_rows n
+                JOIN chat c ON c.id = n.chat_id
+                WHERE n.role != 'user'
+                AND effective_model_id(n.selected_model_id, n.model_id) IS NOT NULL
+                AND COALESCE((c.meta->>'imported')::boolean, false) = false
+                GROUP BY c.user_id, n.chat_id, 3, 4
+            ),
+            counted AS (
+                INSERT INTO chat_day_model_count (chat_id, date, model_id, msg_count)
+                SELECT chat_id, date, model_id, message_count FROM per_chat
+                ON CONFLICT (chat_id, date, model_id) DO UPDATE SET
+                    msg_count = chat_day_model_count.msg_count + EXCLUDED.msg_count
+                RETURNING chat_id, date, model_id, msg_count
+            )
+            INSERT INTO metrics_daily_rollup (
+                user_id, date, model_id, message_count, total_cost,
+                total_input_tokens, total_output_tokens, total_reasoning_tokens,
+                distinct_chat_count, created_at, updated_at
+            )
+            SELECT
+                p.user_id,
+                p.date,
+                p.model_id,
+                SUM(p.message_count),
+                SUM(p.total_cost),
+                SUM(p.total_input_tokens),
+                SUM(p.total_output_tokens),
+                SUM(p.total_reasoning_tokens),
+                -- A chat is new for the day when this statement accounts for its whole counter.
+                -- This reads the counter tuple the upsert already returned, same as the
+                -- RETURNING (xmax = 0) "was inserted" test would, but unlike that test it
+                -- also stays right if an emptied counter row were ever left behind.
+                COUNT(*) FILTER (WHERE cnt.msg_count = p.message_count),
+                v_now_epoch,
+                v_now_epoch
+            FROM per_chat p
+            JOIN counted cnt
+                ON cnt.chat_id = p.chat_id AND cnt.date = p.date AND cnt.model_id = p.model_id
+            GROUP BY p.user_id, p.date, p.model_id
+            ON CONFLICT (user_id, date, model_id) DO UPDATE SET
+                message_count = metrics_daily_rollup.message_count + EXCLUDED.message_count,
+                total_cost = metrics_daily_rollup.total_cost + EXCLUDED.total_cost,
+                total_input_tokens = metrics_daily_rollup.total_input_tokens + EXCLUDED.total_input_tokens,
+                total_output_tokens = metrics_daily_rollup.total_output_tokens + EXCLUDED.total_output_tokens,
+                total_reasoning_tokens = metrics_daily_rollup.total_reasoning_tokens + EXCLUDED.total_reasoning_tokens,
+                distinct_chat_count = metrics_daily_rollup.distinct_chat_count + EXCLUDED.distinct_chat_count,
+                updated_at = EXCLUDED.updated_at;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+    )
+
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION update_metrics_daily_rollup_delete_batch()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            v_now_epoch BIGINT := EXTRACT(EPOCH FROM NOW())::bigint;
+            v_emptied_counters BOOLEAN;
+            v_emptied_user_ids TEXT[];
+            v_emptied_dates DATE[];
+            v_emptied_model_ids TEXT[];
+        BEGIN
+            IF current_setting('open_webui.skip_metrics_rollup', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+
+            WITH per_chat AS (
+                SELECT
+                    c.user_id,
+                    o.chat_id,
+                    DATE(to_timestamp(o.created_at)) AS date,
+                    effective_model_id(o.selected_model_id, o.model_id) AS model_id,
+                    COUNT(*) AS message_count,
+                    SUM(COALESCE(o.cost, 0)) AS total_cost,
+                    SUM(COALESCE(o.input_tokens, 0)) AS total_input_tokens,
+                    SUM(COALESCE(o.output_tokens, 0)) AS total_output_tokens,
+                    SUM(COALESCE(o.reasoning_tokens, 0)) AS total_reasoning_tokens
+                FROM old_rows o
+                JOIN chat c ON c.id = o.chat_id
+                WHERE o.role != 'user'
+                AND effective_model_id(o.selected_model_id, o.model_id) IS NOT NULL
+                AND COALESCE((c.meta->>'imported')::boolean, false) = false
+                GROUP BY c.user_id, o.chat_id, 3, 4
+            ),
+            counted AS (
+                UPDATE chat_day_model_count cnt
+                SET msg_count = cnt.msg_count - p.message_count
+                FROM per_chat p
+                WHERE cnt.chat_id = p.chat_id AND cnt.date = p.date AND cnt.model_id = p.model_id
+                RETURNING cnt.chat_id, cnt.date, cnt.model_id, cnt.msg_count
+            ),
+            deltas AS (
+                SELECT
+                    p.user_id,
+                    p.date,
+                    p.model_id,
+                    SUM(p.message_count) AS message_count,
+                    SUM(p.total_cost) AS total_cost,
+                    SUM(p.total_input_tokens) AS total_input_tokens,
+                    SUM(p.total_output_tokens) AS total_output_tokens,
+                    SUM(p.total_reasoning_tokens) AS total_reasoning_tokens,
+                    -- A missing counter means nothing else of that chat is tracked for the day
+                    COUNT(*) FILTER (WHERE cnt.msg_count IS NULL OR cnt.msg_count <= 0) AS emptied_chats
+                FROM per_chat p
+                LEFT JOIN counted cnt
+                    ON cnt.chat_id = p.chat_id AND cnt.date = p.date AND cnt.model_id = p.model_id
+                GROUP BY p.user_id, p.date, p.model_id
+            ),
+            rolled AS (
+                UPDATE metrics_daily_rollup r
+                SET
+                    message_count = GREATEST(0, r.message_count - d.message_count),
+                    total_cost = GREATEST(0, r.total_cost - d.total_cost),
+                    total_input_tokens = GREATEST(0, r.total_input_tokens - d.total_input_tokens),
+                    total_output_tokens = GREATEST(0, r.total_output_tokens - d.total_output_tokens),
+                    total_reasoning_tokens = GREATEST(0, r.total_reasoning_tokens - d.total_reasoning_tokens),
+                    distinct_chat_count = GREATEST(0, r.distinct_chat_count - d.emptied_chats),
+                    updated_at = v_now_epoch
+                FROM deltas d
+                WHERE r.user_id = d.user_id AND r.date = d.date AND r.model_id = d.model_id
+                RETURNING r.user_id, r.date, r.model_id, r.message_count
+            )
+            -- Collect the keys of emptied rollup rows here so the DELETE below does not
+            -- have to join chat and recompute day/model for every deleted message again
+            SELECT
+                EXISTS (SELECT 1 FROM counted WHERE msg_count <= 0),
+                array_agg(user_id) FILTER (WHERE message_count = 0),
+                array_agg(date) FILTER (WHERE message_count = 0),
+                array_agg(model_id) FILTER (WHERE message_count = 0)
+            INTO v_emptied_counters, v_emptied_user_ids, v_emptied_dates, v_emptied_model_ids
+            FROM rolled;
+
+            -- Rows updated above are invisible to further writes in the same statement,
+            -- so emptied counters and rollup rows are removed in separate statements
+            IF v_emptied_counters THEN
+                DELETE FROM chat_day_model_count
+                WHERE chat_id IN (SELECT chat_id FROM old_rows)
+                AND msg_count <= 0;
+            END IF;
+
+            IF v_emptied_user_ids IS NOT NULL THEN
+                DELETE FROM metrics_daily_rollup
+                WHERE (user_id, date, model_id) IN (
+                    SELECT * FROM unnest(v_emptied_user_ids, v_emptied_dates, v_emptied_model_ids)
+                )
+                AND message_count = 0;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+    )
+
+    skip_condition = "COALESCE(current_setting('open_webui.skip_metrics_rollup', true), 'off') <> 'on'"
+
+    op.execute(
+        f"""
+        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_insert ON chat_message;
+        CREATE TRIGGER trigger_update_metrics_daily_rollup_insert
+        AFTER INSERT ON chat_message
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        WHEN ({skip_condition})
+        EXECUTE FUNCTION update_metrics_daily_rollup_insert_batch();
+    """
+    )
+
+    op.execute(
+        f"""
+        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_delete ON chat_message;
+        CREATE TRIGGER trigger_update_metrics_daily_rollup_delete
+        AFTER DELETE ON chat_message
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT
+        WHEN ({skip_condition})
+        EXECUTE FUNCTION update_metrics_daily_rollup_delete_batch();
+    """
+    )
+
+    # UPDATEs stay row-level: transition tables cannot be combined with an
+    # UPDATE OF column list, which keeps content-only edits from firing at all.
+    # Split UPDATE handling: re-keying changes (date, model, role, chat) keep the
+    # full row function, while pure token/cost corrections - the common case after a
+    # response finishes streaming - go through a function that is one UPDATE.
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION update_metrics_daily_rollup_fast()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF current_setting('open_webui.skip_metrics_rollup', true) = 'on' THEN
+                RETURN NEW;
+            END IF;
+
+            UPDATE metrics_daily_rollup r
+            SET
+                total_cost = r.total_cost - COALESCE(OLD.cost, 0) + COALESCE(NEW.cost, 0),
+                total_input_tokens = r.total_input_tokens - COALESCE(OLD.input_tokens, 0) + COALESCE(NEW.input_tokens, 0),
+                total_output_tokens = r.total_output_tokens - COALESCE(OLD.output_tokens, 0) + COALESCE(NEW.output_tokens, 0),
+                total_reasoning_tokens = r.total_reasoning_tokens - COALESCE(OLD.reasoning_tokens, 0) + COALESCE(NEW.reasoning_tokens, 0),
+                updated_at = EXTRACT(EPOCH FROM NOW())::bigint
+            FROM chat c
+            WHERE c.id = NEW.chat_id
+            AND COALESCE((c.meta->>'imported')::boolean, false) = false
+            AND r.user_id = c.user_id
+            AND r.date = DATE(to_timestamp(NEW.created_at))
+            AND r.model_id = effective_model_id(NEW.selected_model_id, NEW.model_id);
+
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+    )
+
+    op.execute(
+        f"""
+        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_update ON chat_message;
+        CREATE TRIGGER trigger_update_metrics_daily_rollup_update
+        AFTER UPDATE OF model_id, selected_model_id, created_at, role, chat_id ON chat_message
+        FOR EACH ROW
+        WHEN (
+            (
+                OLD.model_id IS DISTINCT FROM NEW.model_id
+                OR OLD.selected_model_id IS DISTINCT FROM NEW.selected_model_id
+                OR OLD.created_at IS DISTINCT FROM NEW.created_at
+                OR OLD.role IS DISTINCT FROM NEW.role
+                OR OLD.chat_id IS DISTINCT FROM NEW.chat_id
+            )
+            AND {skip_condition}
+        )
+        EXECUTE FUNCTION update_metrics_daily_rollup();
+    """
+    )
+
+    op.execute(
+        f"""
+        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_update_fast ON chat_message;
+        CREATE TRIGGER trigger_update_metrics_daily_rollup_update_fast
+        AFTER UPDATE OF cost, input_tokens, output_tokens, reasoning_tokens ON chat_message
+        FOR EACH ROW
+        WHEN (
+            (
+                OLD.cost IS DISTINCT FROM NEW.cost
+                OR OLD.input_tokens IS DISTINCT FROM NEW.input_tokens
+                OR OLD.output_tokens IS DISTINCT FROM NEW.output_tokens
+                OR OLD.reasoning_tokens IS DISTINCT FROM NEW.reasoning_tokens
+            )
+            AND NEW.role != 'user'
+            AND OLD.role = NEW.role
+            AND OLD.created_at = NEW.created_at
+            AND OLD.model_id IS NOT DISTINCT FROM NEW.model_id
+            AND OLD.selected_model_id IS NOT DISTINCT FROM NEW.selected_model_id
+            AND OLD.chat_id = NEW.chat_id
+            AND {skip_condition}
+        )
+        EXECUTE FUNCTION update_metrics_daily_rollup_fast();
+    """
+    )
+
+    # Nothing probes chat_message for other messages of a chat/day/model any more.
+    # Dropped CONCURRENTLY so the lock on chat_message is not held while waiting
+    # for in-flight queries; this commits everything above first.
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_chat_message_chatid_createdat_model_role")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        return
+
+    # Restore the md5 surrogate key the previous function writes
+    op.execute(
+        """
+        ALTER TABLE metrics_daily_rollup
+            DROP CONSTRAINT metrics_daily_rollup_pkey,
+            ALTER COLUMN model_id DROP NOT NULL,
+            ADD COLUMN id TEXT
+        """
+    )
+    op.execute(
+        """
+        UPDATE metrics_daily_rollup
+        SET id = md5(user_id || '|' || date::text || '|' || COALESCE(model_id, ''))::text
+        """
+    )
+    op.execute(
+        """
+        ALTER TABLE metrics_daily_rollup
+            ADD CONSTRAINT metrics_daily_rollup_pkey PRIMARY KEY (id),
+            ADD CONSTRAINT uq_metrics_daily_rollup_user_date_model UNIQUE (user_id, date, model_id)
+        """
+    )
+
+    # The previous function's EXISTS checks need the chat/day/model index back
+    with op.get_context().autocommit_block():
+        op.execute(
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_message_chatid_createdat_model_role
+            ON chat_message (chat_id, created_at, model_id, selected_model_id)
+            WHERE role <> 'user'
+            """
+        )
+
+    # Reinstall the trigger function from exclude_imported_chats_metrics
+    load_migration_module("exclude_imported_chats_from_metrics").upgrade()
+
+    # Restore the row-level triggers (with the skip guard) before dropping the batch functions
+    load_migration_module("skip_metrics_rollup_realtime").upgrade()
+    op.execute("DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_update_fast ON chat_message")
+    op.execute("DROP FUNCTION IF EXISTS update_metrics_daily_rollup_fast()")
+    op.execute("DROP FUNCTION IF EXISTS update_metrics_daily_rollup_insert_batch()")
+    op.execute("DROP FUNCTION IF EXISTS update_metrics_daily_rollup_delete_batch()")
+    op.execute("DROP FUNCTION IF EXISTS effective_model_id(TEXT, TEXT)")
+
+    op.execute("DROP TABLE IF EXISTS chat_day_model_count")
@@ -0,0 +1,164 @@
+"""partition metrics daily rollup by month
+
+Revision ID: partition_metrics_daily_rollup
+Revises: optimize_metrics_rollup_trigger
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "partition_metrics_daily_rollup"
+down_revision = "optimize_metrics_rollup_trigger"
+branch_labels = None
+depends_on = None
+
+# Months past the current one whose partitions are created up front
+PARTITION_MONTHS_AHEAD = 2
+
+# Secondary indexes of metrics_daily_rollup, recreated on whichever table holds the data
+ROLLUP_INDEXES = {
+    "ix_metrics_daily_rollup_user_id": "(user_id)",
+    "ix_metrics_daily_rollup_date": "(date)",
+    "ix_metrics_daily_rollup_model_id": "(model_id)",
+    "ix_metrics_daily_rollup_user_date": "(user_id, date)",
+    "ix_metrics_daily_rollup_user_model_date": "(user_id, model_id, date)",
+}
+
+
+def _create_rollup_indexes() -> None:
+    for name, columns in ROLLUP_INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON metrics_daily_rollup {columns}")
+
+
+def upgrade() -> None:
+    """
+    Turn metrics_daily_rollup into a table partitioned by month on date.
+
+    Each month's rows (and their primary key index, which every trigger upsert
+    probes) live in their own partition, so the hot index stays the size of one
+    month, dashboard date ranges prune to the months they cover, and retention
+    becomes DROP/DETACH of a partition instead of a bulk DELETE.
+
+    A DEFAULT partition catches rows for months that have no partition yet, and
+    ensure_metrics_daily_rollup_partition() creates a month's partition (moving any
+    rows already in the default partition into it). The application calls it
+    periodically to stay PARTITION_MONTHS_AHEAD months ahead.
+    """
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        return
+
+    # Move the current table aside; its index names are reused below
+    op.execute("ALTER TABLE metrics_daily_rollup RENAME TO metrics_daily_rollup_old")
+    op.execute(
+        "ALTER TABLE metrics_daily_rollup_old RENAME CONSTRAINT metrics_daily_rollup_pkey TO metrics_daily_rollup_old_pkey"
+    )
+
+    # The partition key has to be part of the primary key, which (user_id, date, model_id)
+    # already is; keeping user_id first keeps per-user date-range scans on the index prefix
+    op.execute(
+        """
+        CREATE TABLE metrics_daily_rollup (LIKE metrics_daily_rollup_old INCLUDING DEFAULTS)
+        PARTITION BY RANGE (date)
+        """
+    )
+    op.execute(
+        """
+        ALTER TABLE metrics_daily_rollup
+            ADD CONSTRAINT metrics_daily_rollup_pkey PRIMARY KEY (user_id, date, model_id)
+        """
+    )
+    op.execute("CREATE TABLE metrics_daily_rollup_default PARTITION OF metrics_daily_rollup DEFAULT")
+
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION ensure_metrics_daily_rollup_partition(p_date DATE)
+        RETURNS VOID AS $$
+        DECLARE
+            v_start DATE := date_trunc('month', p_date)::date;
+            v_end DATE := (date_trunc('month', p_date) + INTERVAL '1 month')::date;
+            v_name TEXT := 'metrics_daily_rollup_' || to_char(p_date, '"y"YYYY"m"MM');
+        BEGIN
+            -- Several app instances may run the maintenance job at the same time
+            PERFORM pg_advisory_xact_lock(hashtext('ensure_metrics_daily_rollup_partition'));
+
+            IF to_regclass(v_name) IS NOT NULL THEN
+                RETURN;
+            END IF;
+
+            -- A partition cannot be attached while the default partition holds rows of
+            -- its range, so build it standalone, move those rows over, then attach it
+            EXECUTE format(
+                'CREATE TABLE %I (LIKE metrics_daily_rollup INCLUDING DEFAULTS)',
+                v_name
+            );
+            -- The advisory lock only serializes maintenance runs; block trigger upserts into
+            -- the default partition until the attach commits, or a row for this month landing
+            -- there after the move would make the attach's default-partition scan fail
+            LOCK TABLE metrics_daily_rollup_default IN SHARE ROW EXCLUSIVE MODE;
+            EXECUTE format(
+                'WITH moved AS (
+                    DELETE FROM metrics_daily_rollup_default
+                    WHERE date >= %L AND date < %L
+                    RETURNING *
+                )
+                INSERT INTO %I SELECT * FROM moved',
+                v_start, v_end, v_name
+            );
+            EXECUTE format(
+                'ALTER TABLE metrics_daily_rollup ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                v_name, v_start, v_end
+            );
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+    )
+
+    # One partition per month that has data, through PARTITION_MONTHS_AHEAD months from now
+    op.execute(
+        f"""
+        SELECT ensure_metrics_daily_rollup_partition(month::date)
+        FROM generate_series(
+            date_trunc('month', COALESCE((SELECT MIN(date) FROM metrics_daily_rollup_old), CURRENT_DATE)),
+            date_trunc('month', CURRENT_DATE) + INTERVAL '{PARTITION_MONTHS_AHEAD} months',
+            INTERVAL '1 month'
+        ) AS month
+        """
+    )
+
+    op.execute("INSERT INTO metrics_daily_rollup SELECT * FROM metrics_daily_rollup_old")
+    op.execute("DROP TABLE metrics_daily_rollup_old")
+    _create_rollup_indexes()
+    op.execute("ANALYZE metrics_daily_rollup")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE metrics_daily_rollup RENAME TO metrics_daily_rollup_partitioned")
+    op.execute(
+        "ALTER TABLE metrics_daily_rollup_partitioned RENAME CONSTRAINT metrics_daily_rollup_pkey TO metrics_daily_rollup_partitioned_pkey"
+    )
+    for name in ROLLUP_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+
+    op.execute("CREATE TABLE metrics_daily_rollup (LIKE metrics_daily_rollup_partitioned INCLUDING DEFAULTS)")
+    op.execute(
+        """
+        ALTER TABLE metrics_daily_rollup
+            ADD CONSTRAINT metrics_daily_rollup_pkey PRIMARY KEY (user_id, date, model_id)
+        """
+    )
+    op.execute("INSERT INTO metrics_daily_rollup SELECT * FROM metrics_daily_rollup_partitioned")
+
+    # Dropping the parent drops every partition with it
+    op.execute("DROP TABLE metrics_daily_rollup_partitioned")
+    op.execute("DROP FUNCTION IF EXISTS ensure_metrics_daily_rollup_partition(DATE)")
+
+    _create_rollup_indexes()
+    op.execute("ALTER TABLE metrics_daily_rollup CLUSTER ON metrics_daily_rollup_pkey")
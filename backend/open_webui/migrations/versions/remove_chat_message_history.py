@@ -9,8 +9,14 @@ from alembic import op
 import sqlalchemy as sa
 from sqlalchemy.sql import table, column
 from sqlalchemy import String, JSON
+from open_webui.migrations.util import (
+    MAINTENANCE_WORK_MEM,
+    compact_table,
+    strip_chat_message_history,
+)
 
-import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 
 # revision identifiers, used by Alembic.
@@ -19,6 +25,32 @@ down_revision = 'add_embedding_metrics_tracking'
 branch_labels = None
 depends_on = None
 
+# Rows fetched per round trip when decoding chat blobs in Python
+FETCH_BATCH_SIZE = 1000
+
+# Per-chat parse errors printed before only counting the rest
+MAX_REPORTED_ERRORS = 20
+
+# Heap pages of chat rewritten per committed chunk on PostgreSQL 14+ (~80 MB of
+# main-table pages; the blobs themselves live in TOAST)
+UPDATE_CHUNK_PAGES = 10000
+
+# Rewritten chats sent per executemany
+UPDATE_BATCH_SIZE = 500
+
+# Fetched batches with at least this many rows are decoded/stripped in worker
+# processes; smaller ones (the common case) stay in-process
+PARALLEL_MIN_ROWS = 64
+
+# Run VACUUM ANALYZE on chat after the cleanup (PostgreSQL only); set to False to
+# leave it to the operator
+AUTO_VACUUM = os.environ.get("DATABASE_MIGRATION_AUTO_VACUUM", "True").lower() == "true"
+
+# Optionally rewrite chat afterwards to return the freed TOAST space to the OS:
+# "full" (VACUUM FULL), "cluster" (CLUSTER on the primary key) or "none".
+# Both rewrites hold an exclusive lock on chat while they run.
+COMPACT_MODE = os.environ.get("DATABASE_MIGRATION_COMPACT", "none").lower()
+
 
 def upgrade() -> None:
     """
@@ -35,6 +67,7 @@ def upgrade() -> None:
     - Any other metadata
     """
     conn = op.get_bind()
+    dialect_name = conn.dialect.name
     
     chat_table = table(
         'chat',
@@ -42,83 +75,258 @@ def upgrade() -> None:
         column('chat', JSON),
     )
     
-    # Fetch all chats with their JSON blobs
-    rows = conn.execute(sa.select(chat_table.c.id, chat_table.c.chat)).fetchall()
-    
     updated_count = 0
+    
+    # Strip both keys server-side in a single statement, so the blobs never make a
+    # round trip through Python. The WHERE clauses mirror the SET expressions exactly
+    # (same keys, same object-only history check), so every matched row really
+    # changes and no no-op row versions are written (no dead tuples, no extra WAL).
+    if dialect_name == 'postgresql':
+        # Blobs stored as a JSON-encoded string can only be decoded in SQL where the
+        # server can check the text first (IS JSON, PostgreSQL 16+); a failed cast
+        # would abort the whole statement
+        server_version = int(conn.exec_driver_sql("SHOW server_version_num").scalar())
+        decode_strings = server_version >= 160000
+        string_blobs = (
+            "OR (json_typeof(chat) = 'string' AND (chat #>> '{}') IS JSON OBJECT)"
+            if decode_strings
+            else ""
+        )
+        # Every chat::jsonb re-parses the whole json text, so each blob is parsed once
+        # in the subquery (OFFSET 0 keeps it from being flattened back into the
+        # predicates) and the filter and SET work on that jsonb value. #- errors on
+        # a path through an array, so only descend into object histories.
+        strip_sql = """
+            UPDATE chat
+            SET chat = (
+                CASE WHEN jsonb_typeof(parsed.blob -> 'history') = 'object'
+                    THEN (parsed.blob - 'messages') #- '{{history,messages}}'
+                    ELSE parsed.blob - 'messages'
+                END
+            )::json
+            FROM (
+                SELECT
+                    id,
+                    CASE WHEN json_typeof(chat) = 'object'
+                        THEN chat::jsonb
+                        ELSE (chat #>> '{{}}')::jsonb
+                    END AS blob
+                FROM chat
+                WHERE (json_typeof(chat) = 'object' {string_blobs})
+                  {chunk_filter}
+                OFFSET 0
+            ) AS parsed
+            WHERE chat.id = parsed.id
+              AND (
+                parsed.blob ? 'messages'
+                OR (
+                    jsonb_typeof(parsed.blob -> 'history') = 'object'
+                    AND (parsed.blob -> 'history') ? 'messages'
+                )
+              )
+        """
+        
+        if server_version >= 140000:
+            # Work through the heap in block ranges (TID range scans, PostgreSQL 14+),
+            # each committed on its own, so WAL and the open transaction stay bounded
+            # and autovacuum can reclaim space while the rest is processed. Rewritten
+            # rows that land in a later range no longer match, so nothing is counted
+            # twice. The autocommit block commits the migration's work so far.
+            chunk_stmt = sa.text(strip_sql.format(
+                string_blobs=string_blobs,
+                chunk_filter="AND ctid >= CAST(:lo AS tid) AND ctid < CAST(:hi AS tid)",
+            ))
+            with op.get_context().autocommit_block():
+                chunk_conn = op.get_bind()
+                # Don't wait for a WAL flush at every chunk commit. A crash can lose
+                # the last few chunks, but re-running the migration redoes exactly
+                # those (only rows that still have messages match). Session-level
+                # SET because each chunk commits on its own.
+                chunk_conn.execute(sa.text("SET synchronous_commit = off"))
+                try:
+                    block_count = chunk_conn.execute(sa.text(
+                        "SELECT pg_relation_size('chat') / current_setting('block_size')::int"
+                    )).scalar()
+                    for lo in range(0, block_count, UPDATE_CHUNK_PAGES):
+                        hi = lo + UPDATE_CHUNK_PAGES
+                        result = chunk_conn.execute(chunk_stmt, {'lo': f'({lo},0)', 'hi': f'({hi},0)'})
+                        updated_count += result.rowcount
+                        print(f"  Processed chat pages {min(hi, block_count)}/{block_count} ({updated_count} chats updated)")
+                finally:
+                    chunk_conn.execute(sa.text("RESET synchronous_commit"))
+            conn = op.get_bind()
+        else:
+            result = conn.execute(sa.text(strip_sql.format(string_blobs=string_blobs, chunk_filter="")))
+            updated_count += result.rowcount
+        if decode_strings:
+            fallback_filter = sa.false()
+        else:
+            # Older servers decode string-encoded blobs in Python; only fetch the
+            # ones that can contain a messages key at all
+            fallback_filter = sa.text(
+                "json_typeof(chat) = 'string' AND (chat #>> '{}') LIKE '%\"messages\"%'"
+            )
+    elif dialect_name == 'sqlite':
+        # json_remove() ignores paths that do not exist (including through non-objects);
+        # json_type() raises on malformed JSON, hence the json_valid() guards. A blob
+        # stored as a JSON-encoded string (json_type 'text') is decoded with
+        # json_extract(chat, '$') and rewritten as the object it contains.
+        decoded = "json_extract(chat, '$')"
+        
+        def has_messages(blob):
+            return f"""(
+                json_type({blob}, '$.messages') IS NOT NULL
+                OR (
+                    json_type({blob}, '$.history') = 'object'
+                    AND json_type({blob}, '$.history.messages') IS NOT NULL
+                )
+            )"""
+        
+        result = conn.execute(sa.text(f"""
+            UPDATE chat
+            SET chat = json_remove(
+                CASE WHEN json_type(chat) = 'text' THEN {decoded} ELSE chat END,
+                '$.messages', '$.history.messages'
+            )
+            WHERE CASE
+                WHEN NOT json_valid(chat) THEN NULL
+                WHEN json_type(chat) = 'object' THEN {has_messages('chat')}
+                WHEN json_type(chat) = 'text'
+                    AND json_valid({decoded})
+                    AND json_type({decoded}) = 'object'
+                    THEN {has_messages(decoded)}
+            END
+        """))
+        updated_count += result.rowcount
+        fallback_filter = sa.false()
+    else:
+        fallback_filter = None
+    
+    # Rows the statements above cannot handle (string-encoded blobs on PostgreSQL
+    # before 16, or every row on other dialects) go through the per-row path
+    query = sa.select(chat_table.c.id, chat_table.c.chat)
+    if fallback_filter is not None:
+        query = query.where(fallback_filter)
+    # Stream the rows through a server-side cursor rather than materializing every
+    # blob at once, so memory stays bounded by the batch size
+    rows = conn.execute(
+        query.execution_options(stream_results=True, yield_per=FETCH_BATCH_SIZE)
+    )
+    
+    update_stmt = (
+        sa.update(chat_table)
+        .where(chat_table.c.id == sa.bindparam('b_id'))
+        .values(chat=sa.bindparam('b_chat'))
+    )
+    pending = []
+    
+    def flush_pending():
+        # One executemany per batch instead of a round trip per chat
+        nonlocal updated_count, error_count
+        if not pending:
+            return
+        try:
+            conn.execute(update_stmt, pending)
+            updated_count += len(pending)
+        except Exception as e:
+            print(f"Error updating {len(pending)} chats: {e}")
+            error_count += len(pending)
+        pending.clear()
+    
     skipped_count = 0
     skipped_null = 0
     skipped_no_messages = 0
     skipped_not_dict = 0
     error_count = 0
     
-    for row in rows:
-        chat_id = row.id
-        chat_json = row.chat
-        
-        if not chat_json:
-            skipped_count += 1
-            skipped_null += 1
-            continue
-        
-        # Normalize chat_json type (handle string JSON)
-        if isinstance(chat_json, str):
-            try:
-                chat_json = json.loads(chat_json)
-            except Exception as e:
-                print(f"Error parsing JSON for chat {chat_id}: {e}")
-                error_count += 1
-                continue
-        
-        if not isinstance(chat_json, dict):
-            skipped_count += 1
-            skipped_not_dict += 1
-            continue
-        
-        # Track if we made any changes
-        updated = False
-        
-        # Remove history.messages if it exists
-        if 'history' in chat_json and isinstance(chat_json['history'], dict):
-            if 'messages' in chat_json['history']:
-                del chat_json['history']['messages']
-                updated = True
-        
-        # Remove messages array if it exists
-        if 'messages' in chat_json:
-            del chat_json['messages']
-            updated = True
-        
-        # Only update if we made changes
-        if updated:
-            try:
-                conn.execute(
-                    sa.update(chat_table)
-                    .where(chat_table.c.id == chat_id)
-                    .values(chat=chat_json)
-                )
-                updated_count += 1
-            except Exception as e:
-                print(f"Error updating chat {chat_id}: {e}")
-                error_count += 1
-        else:
-            # Chat had no message data to remove (already normalized)
-            skipped_count += 1
-            skipped_no_messages += 1
+    # Parsing and re-encoding multi-MB blobs is CPU-bound, so large batches are spread
+    # over a process pool; all database I/O stays on this connection
+    pool = None
+    try:
+        for partition in rows.partitions():
+            chats = [row.chat for row in partition]
+            if pool is None and len(partition) >= PARALLEL_MIN_ROWS:
+                pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+            if pool is not None and len(partition) >= PARALLEL_MIN_ROWS:
+                results = pool.map(strip_chat_message_history, chats, chunksize=64)
+            else:
+                results = map(strip_chat_message_history, chats)
+            
+            for row, (status, value) in zip(partition, results):
+                if status == 'updated':
+                    # Unchanged chats never reach the batch, so they don't get a new
+                    # (identical) row version
+                    pending.append({'b_id': row.id, 'b_chat': value})
+                    if len(pending) >= UPDATE_BATCH_SIZE:
+                        flush_pending()
+                elif status == 'error':
+                    # A corrupt table can fail on most rows; report a sample rather
+                    # than writing a line per row from the hot loop
+                    if error_count < MAX_REPORTED_ERRORS:
+                        print(f"Error parsing JSON for chat {row.id}: {value}")
+                    error_count += 1
+                else:
+                    skipped_count += 1
+                    if status == 'null':
+                        skipped_null += 1
+                    elif status == 'not_dict':
+                        skipped_not_dict += 1
+                    else:
+                        # Chat had no message data to remove (already normalized)
+                        skipped_no_messages += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    
+    flush_pending()
     
     print("Migration complete:")
     print(f"  Updated: {updated_count} chats (removed message history)")
-    print(f"  Skipped: {skipped_count} chats total")
-    print(f"    - Already normalized (no messages): {skipped_no_messages}")
-    print(f"    - NULL/empty chat JSON: {skipped_null}")
-    print(f"    - Not a dict: {skipped_not_dict}")
+    if fallback_filter is None:
+        print(f"  Skipped: {skipped_count} chats total")
+        print(f"    - Already normalized (no messages): {skipped_no_messages}")
+        print(f"    - NULL/empty chat JSON: {skipped_null}")
+        print(f"    - Not a dict: {skipped_not_dict}")
+    elif skipped_count:
+        print(f"  Skipped (string-encoded JSON without messages): {skipped_count} chats")
     print(f"  Errors: {error_count} chats")
+    if error_count > MAX_REPORTED_ERRORS:
+        print(f"    - Only the first {MAX_REPORTED_ERRORS} parse errors were printed above")
     
     # Important: Reclaim disk space after UPDATE operations
     # PostgreSQL doesn't automatically reclaim space after UPDATEs - old versions remain until VACUUM
-    # VACUUM cannot run inside a transaction, so it must be run manually after the migration
-    dialect_name = conn.dialect.name
-    if dialect_name == 'postgresql':
+    # VACUUM cannot run inside a transaction, so it runs in an autocommit block (which
+    # commits the migration's work so far) unless disabled
+    compact_mode = COMPACT_MODE
+    if compact_mode not in ('full', 'cluster', 'none'):
+        print(f"Ignoring unknown DATABASE_MIGRATION_COMPACT value: {compact_mode}")
+        compact_mode = 'none'
+    
+    if dialect_name == 'postgresql' and compact_mode != 'none':
+        print()
+        compact_table('chat', compact_mode)
+    elif dialect_name == 'postgresql' and AUTO_VACUUM:
+        size_query = sa.text("SELECT pg_size_pretty(pg_total_relation_size('chat'))")
+        size_before = conn.execute(size_query).scalar()
+        
+        print("\nRunning VACUUM ANALYZE chat to reclaim space from the removed message data...")
+        with op.get_context().autocommit_block():
+            bind = op.get_bind()
+            bind.execute(sa.text(f"SET maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'"))
+            try:
+                # VACUUM also processes the table's TOAST relation, where the large blobs live
+                bind.execute(sa.text("VACUUM (ANALYZE) chat"))
+            finally:
+                bind.execute(sa.text("RESET maintenance_work_mem"))
+        
+        size_after = op.get_bind().execute(size_query).scalar()
+        print(f"chat size (including TOAST and indexes): {size_before} -> {size_after}")
+        print("\n⚠️  Note: Regular VACUUM may not return all space from large JSON columns to the OS.")
+        print("   For maximum space reclamation (especially TOAST storage), rerun with")
+        print("   DATABASE_MIGRATION_COMPACT=full or cluster, or run manually:")
+        print("   VACUUM FULL chat;")
+        print("   (WARNING: VACUUM FULL requires an exclusive lock and rewrites the table)")
+    elif dialect_name == 'postgresql':
         print("\n" + "="*70)
         print("IMPORTANT: Run VACUUM ANALYZE to reclaim disk space")
         print("="*70)
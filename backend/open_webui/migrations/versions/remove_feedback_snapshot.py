@@ -7,6 +7,10 @@ Create Date: 2025-11-16 20:48:00.000000
 """
 from alembic import op
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from open_webui.migrations.util import compact_table
+
+import os
 
 
 # revision identifiers, used by Alembic.
@@ -15,6 +19,10 @@ down_revision = 'remove_chat_message_history'
 branch_labels = None
 depends_on = None
 
+# Rewrite feedback after dropping the column so its TOAST data is actually freed:
+# "full" (VACUUM FULL), "cluster" (CLUSTER on the primary key) or "none"
+COMPACT_MODE = os.environ.get("DATABASE_MIGRATION_COMPACT", "none").lower()
+
 
 def upgrade() -> None:
     """
@@ -23,8 +31,22 @@ def upgrade() -> None:
     The snapshot column stored redundant chat history that is already
     available in the chats table. This migration removes the column
     to reduce database bloat.
+    
+    On PostgreSQL DROP COLUMN only marks the column as dropped; the snapshot data
+    stays on disk (mostly in TOAST) until the table is rewritten.
     """
     op.drop_column('feedback', 'snapshot')
+    
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    
+    if COMPACT_MODE in ('full', 'cluster'):
+        compact_table('feedback', COMPACT_MODE)
+    else:
+        print("Note: the dropped feedback snapshot data stays on disk until the table is rewritten.")
+        print("To reclaim it, run manually (takes an exclusive lock on feedback):")
+        print("  VACUUM FULL feedback;")
+        print("or set DATABASE_MIGRATION_COMPACT=full before migrating.")
 
 
 def downgrade() -> None:
@@ -33,9 +55,13 @@ def downgrade() -> None:
     
     Note: This will restore the column structure but will not restore
     any previously stored snapshot data.
+    
+    On PostgreSQL the column comes back as jsonb (binary, indexable) rather than
+    json; the ORM maps either as JSON.
     """
+    snapshot_type = sa.JSON().with_variant(postgresql.JSONB(astext_type=sa.Text()), 'postgresql')
     op.add_column(
         'feedback',
-        sa.Column('snapshot', sa.JSON(), nullable=True)
+        sa.Column('snapshot', snapshot_type, nullable=True)
     )
 
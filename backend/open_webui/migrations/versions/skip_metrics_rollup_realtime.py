@@ -16,6 +16,17 @@ branch_labels = None
 depends_on = None
 
 
+def _replace_trigger(name: str, definition: str) -> None:
+    # PostgreSQL 14+ can swap a trigger definition in place, with no window where the
+    # trigger is missing; older servers need DROP + CREATE
+    server_version = int(op.get_bind().exec_driver_sql("SHOW server_version_num").scalar())
+    if server_version >= 140000:
+        op.execute(f"CREATE OR REPLACE TRIGGER {name}\n{definition}")
+    else:
+        op.execute(f"DROP TRIGGER IF EXISTS {name} ON chat_message")
+        op.execute(f"CREATE TRIGGER {name}\n{definition}")
+
+
 def upgrade() -> None:
     conn = op.get_bind()
     if conn.dialect.name != "postgresql":
@@ -23,21 +34,19 @@ def upgrade() -> None:
 
     skip_condition = "COALESCE(current_setting('open_webui.skip_metrics_rollup', true), 'off') <> 'on'"
 
-    op.execute(
+    _replace_trigger(
+        "trigger_update_metrics_daily_rollup_insert",
         f"""
-        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_insert ON chat_message;
-        CREATE TRIGGER trigger_update_metrics_daily_rollup_insert
         AFTER INSERT ON chat_message
         FOR EACH ROW
         WHEN ({skip_condition})
         EXECUTE FUNCTION update_metrics_daily_rollup();
-    """
+    """,
     )
 
-    op.execute(
+    _replace_trigger(
+        "trigger_update_metrics_daily_rollup_update",
         f"""
-        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_update ON chat_message;
-        CREATE TRIGGER trigger_update_metrics_daily_rollup_update
         AFTER UPDATE OF cost, input_tokens, output_tokens, reasoning_tokens, model_id, selected_model_id, created_at, role ON chat_message
         FOR EACH ROW
         WHEN (
@@ -54,18 +63,17 @@ def upgrade() -> None:
             AND {skip_condition}
         )
         EXECUTE FUNCTION update_metrics_daily_rollup();
-    """
+    """,
     )
 
-    op.execute(
+    _replace_trigger(
+        "trigger_update_metrics_daily_rollup_delete",
         f"""
-        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_delete ON chat_message;
-        CREATE TRIGGER trigger_update_metrics_daily_rollup_delete
         AFTER DELETE ON chat_message
         FOR EACH ROW
         WHEN ({skip_condition})
         EXECUTE FUNCTION update_metrics_daily_rollup();
-    """
+    """,
     )
 
 
@@ -74,20 +82,18 @@ def downgrade() -> None:
     if conn.dialect.name != "postgresql":
         return
 
-    op.execute(
+    _replace_trigger(
+        "trigger_update_metrics_daily_rollup_insert",
         """
-        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_insert ON chat_message;
-        CREATE TRIGGER trigger_update_metrics_daily_rollup_insert
         AFTER INSERT ON chat_message
         FOR EACH ROW
         EXECUTE FUNCTION update_metrics_daily_rollup();
-    """
+    """,
     )
 
-    op.execute(
+    _replace_trigger(
+        "trigger_update_metrics_daily_rollup_update",
         """
-        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_update ON chat_message;
-        CREATE TRIGGER trigger_update_metrics_daily_rollup_update
         AFTER UPDATE OF cost, input_tokens, output_tokens, reasoning_tokens, model_id, selected_model_id, created_at, role ON chat_message
         FOR EACH ROW
         WHEN (OLD.cost IS DISTINCT FROM NEW.cost 
@@ -99,16 +105,15 @@ def downgrade() -> None:
               OR OLD.created_at IS DISTINCT FROM NEW.created_at
               OR OLD.role IS DISTINCT FROM NEW.role)
         EXECUTE FUNCTION update_metrics_daily_rollup();
-    """
+    """,
     )
 
-    op.execute(
+    _replace_trigger(
+        "trigger_update_metrics_daily_rollup_delete",
         """
-        DROP TRIGGER IF EXISTS trigger_update_metrics_daily_rollup_delete ON chat_message;
-        CREATE TRIGGER trigger_update_metrics_daily_rollup_delete
         AFTER DELETE ON chat_message
         FOR EACH ROW
         EXECUTE FUNCTION update_metrics_daily_rollup();
-    """
+    """,
     )
 
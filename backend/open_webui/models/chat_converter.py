@@ -4,24 +4,98 @@ This allows the old API endpoints to work transparently with the new normalized
 """
 import logging
 import time
-import re
 import uuid
 import base64
+import binascii
 import hashlib
 import os
-from typing import Optional, Dict, List
-from open_webui.models.chat_messages import ChatMessages
-from open_webui.models.chats import Chats
+import re
+import orjson
+from decimal import Decimal
+from io import BytesIO
+from typing import Optional, Dict, Iterator, List, Tuple
+from open_webui.models.chat_messages import ChatMessages, MessageCreateForm, extract_cost_from_usage, extract_tokens_from_usage
+from open_webui.models.chats import Chat, Chats
 from open_webui.internal.db import get_db
 from open_webui.models.chat_messages import ChatMessage, ChatMessageAttachment
-from open_webui.models.files import Files, FileForm
+from open_webui.models.files import File, Files, FileForm
+from open_webui.models.knowledge import Knowledge
+from open_webui.models.models import Models
 from open_webui.storage.provider import Storage
-from collections import OrderedDict
+from collections import defaultdict, deque
+from sqlalchemy import func, insert, update
 from open_webui.env import SRC_LOG_LEVELS
 
 log = logging.getLogger(__name__)
 log.setLevel(SRC_LOG_LEVELS.get("MODELS", logging.INFO))
 
+# Rows fetched per round trip when streaming a chat's messages
+MESSAGE_FETCH_BATCH_SIZE = 1000
+# Message ids per IN query when looking up existing messages on import
+EXISTING_FETCH_BATCH_SIZE = 500
+# Bytes read per chunk when embedding files as base64 (a multiple of 3)
+BASE64_READ_CHUNK_SIZE = 3 << 16
+# Characters decoded per chunk when hashing imported base64 files (a multiple of 4)
+BASE64_DECODE_CHUNK_SIZE = 4 << 14
+# Mime type of a data URL header (data:{mime_type};base64)
+DATA_URL_HEADER_RE = re.compile(r"data:([^;:]*)")
+# Legacy message fields stored in chat_message.meta on import (models only for user messages)
+IMPORT_META_KEYS = ("modelIdx", "models", "sources", "merged", "userContext", "lastSentence")
+
+# Cache of normalized_to_legacy_format() output for chats that haven't changed
+# Key: chat_id, Value: (version, orjson payload, cached_at). The version covers the chat row
+# and the count/newest updated_at of its messages. updated_at only has 1s resolution, so a
+# chat is only cached once it has been idle for LEGACY_FORMAT_CACHE_SETTLE seconds.
+LEGACY_FORMAT_CACHE_TTL = 60
+LEGACY_FORMAT_CACHE_SETTLE = 2
+LEGACY_FORMAT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_legacy_format_cache: Dict[str, tuple] = {}
+
+
+def invalidate_legacy_format_cache(chat_id: str) -> None:
+    """Drop the cached legacy representation of a chat (call after writing to it)."""
+    _legacy_format_cache.pop(chat_id, None)
+
+
+def _cache_legacy_format(chat_id: str, version: tuple, chat_content: Dict) -> None:
+    try:
+        payload = orjson.dumps(chat_content, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        return
+    if len(payload) > LEGACY_FORMAT_CACHE_MAX_BYTES // 4:
+        return
+
+    _legacy_format_cache.pop(chat_id, None)
+    # Evict the oldest entries (dicts keep insertion order) until the payload fits
+    total = sum(len(entry[1]) for entry in _legacy_format_cache.values())
+    while _legacy_format_cache and total + len(payload) > LEGACY_FORMAT_CACHE_MAX_BYTES:
+        oldest = next(iter(_legacy_format_cache))
+        total -= len(_legacy_format_cache.pop(oldest)[1])
+    _legacy_format_cache[chat_id] = (version, payload, time.time())
+
+
+# history.messages fields copied into the flat messages list entries
+BRANCH_ENTRY_KEYS = frozenset({
+    "id", "role", "timestamp", "parentId", "childrenIds", "model", "modelName", "modelIdx",
+    "userContext", "done", "lastSentence", "models", "usage", "merged",
+    "annotation", "feedbackId", "selectedModelId",
+})
+# Only copied when exporting (embed_files_as_base64=True)
+BRANCH_EXPORT_KEYS = frozenset({"content", "sources", "files"})
+# Only copied when set to a truthy value
+BRANCH_TRUTHY_KEYS = frozenset({"usage", "merged"})
+
+# Attachment meta fields copied onto rebuilt collection / web_search file objects
+COLLECTION_ATTACHMENT_KEYS = (
+    "id", "name", "description", "type", "status", "user", "collection_name",
+    "collection_names", "user_id", "access_control", "created_at", "updated_at",
+)
+WEB_SEARCH_ATTACHMENT_KEYS = ("collection_name", "name", "urls", "docs", "type")
+
+# Message meta fields copied onto the legacy message, in output order (sources are
+# then stripped of collection files)
+META_PASSTHROUGH_KEYS = ("modelIdx", "models", "userContext", "lastSentence", "sources", "merged")
+
 
 def strip_collection_files(file_item: dict) -> dict:
     """Strip files array and data.file_ids from collection objects."""
@@ -41,6 +115,163 @@ def strip_collection_files(file_item: dict) -> dict:
     return file_item
 
 
+def get_last_sentence(content: str) -> Optional[str]:
+    """Return the last sentence of a message, used as its lastSentence."""
+    if not content:
+        return None
+    # Scan back from the end instead of splitting the whole content: skip the
+    # trailing run of . ! ? then cut after the terminator before it
+    s = content.rstrip()
+    end = len(s)
+    while end > 0 and s[end - 1] in '.!?':
+        end -= 1
+    start = max(s.rfind('.', 0, end), s.rfind('!', 0, end), s.rfind('?', 0, end))
+    last = s[start + 1:].strip()
+    return last if last else None
+
+
+def reconstruct_file_from_metadata(file_id: str, att_type: str, att_meta: dict, embed_files_as_base64: bool) -> dict:
+    """Reconstruct file object from attachment metadata when file record is unavailable."""
+    file_obj = {
+        "id": file_id,
+        "type": att_type,
+    }
+    # Copy metadata from attachment
+    if att_meta:
+        if "name" in att_meta:
+            file_obj["name"] = att_meta["name"]
+        if "description" in att_meta:
+            file_obj["description"] = att_meta["description"]
+        if "status" in att_meta:
+            file_obj["status"] = att_meta["status"]
+        if "collection" in att_meta:
+            file_obj["collection"] = att_meta["collection"]
+        # Build meta dict from attachment metadata
+        file_obj["meta"] = {}
+        # Include all relevant meta fields
+        for key in ["name", "content_type", "size", "data", "collection_name"]:
+            if key in att_meta:
+                file_obj["meta"][key] = att_meta[key]
+    if not embed_files_as_base64:
+        file_obj["url"] = f"/api/v1/files/{file_id}/content"
+    return file_obj
+
+
+def file_record_to_file_obj(file_record, att_type: str, att_meta: dict, knowledge_by_id: dict) -> dict:
+    """
+    Build the legacy file object for a file/image attachment from its file record,
+    merging in the attachment metadata. The URL is left to the caller.
+    """
+    # Start with file record data
+    file_meta = dict(file_record.meta) if file_record.meta else {}
+
+    # Merge attachment metadata (which may have collection info, etc.)
+    if att_meta:
+        # Merge attachment meta into file meta, preserving file record data
+        for key, value in att_meta.items():
+            if key not in file_meta or value is not None:
+                file_meta[key] = value
+
+    # Reconstruct full file structure matching legacy format
+    # Start with all fields from file record and attachment metadata
+    file_obj = {
+        "id": file_record.id,
+        "type": att_type,
+        "meta": file_meta,  # Already merged above
+        "created_at": file_record.created_at,
+        "updated_at": file_record.updated_at,
+    }
+
+    # Add name - prefer attachment meta, then file meta, then filename
+    if "name" in att_meta:
+        file_obj["name"] = att_meta["name"]
+    elif file_meta.get("name"):
+        file_obj["name"] = file_meta["name"]
+    else:
+        file_obj["name"] = file_record.filename
+
+    # Add description if present (from attachment or file meta)
+    if "description" in att_meta:
+        file_obj["description"] = att_meta["description"]
+    elif file_meta.get("description"):
+        file_obj["description"] = file_meta["description"]
+
+    # Add status - prefer attachment meta, then file meta, then default
+    if "status" in att_meta:
+        file_obj["status"] = att_meta["status"]
+    elif file_meta.get("status"):
+        file_obj["status"] = file_meta["status"]
+    else:
+        file_obj["status"] = "processed"  # Default
+
+    # Add collection info if present
+    collection_name = att_meta.get("collection_name") or file_meta.get("collection_name")
+    if collection_name:
+        # Ensure collection_name is in meta
+        if "collection_name" not in file_meta:
+            file_meta["collection_name"] = collection_name
+
+        # Try to get collection details from attachment meta or the prefetched knowledge rows
+        if "collection" in att_meta:
+            file_obj["collection"] = att_meta["collection"]
+        else:
+            knowledge = knowledge_by_id.get(collection_name)
+            if knowledge:
+                file_obj["collection"] = {
+                    "name": knowledge.name or "",
+                    "description": knowledge.description or ""
+                }
+
+    return file_obj
+
+
+def collection_attachment_to_file_obj(att_meta: dict) -> dict:
+    """Rebuild a collection file object from attachment meta, without files and data.file_ids."""
+    file_obj = {
+        "type": "collection",
+    }
+    for key in COLLECTION_ATTACHMENT_KEYS:
+        if key in att_meta:
+            file_obj[key] = att_meta[key]
+    # Copy data but exclude file_ids
+    if "data" in att_meta and isinstance(att_meta["data"], dict):
+        data_copy = {k: v for k, v in att_meta["data"].items() if k != "file_ids"}
+        if data_copy:  # Only add data if there are other fields besides file_ids
+            file_obj["data"] = data_copy
+    return file_obj
+
+
+def web_search_attachment_to_file_obj(att_meta: dict) -> dict:
+    """Rebuild a web_search file object from attachment meta."""
+    file_obj = {
+        "type": "web_search",
+    }
+    for key in WEB_SEARCH_ATTACHMENT_KEYS:
+        if key in att_meta:
+            file_obj[key] = att_meta[key]
+    return file_obj
+
+
+# Builders for attachment types that are reconstructed from attachment meta alone
+ATTACHMENT_META_BUILDERS = {
+    "collection": collection_attachment_to_file_obj,
+    "web_search": web_search_attachment_to_file_obj,
+}
+
+
+def file_to_data_url(file_path: str, mime_type: str) -> str:
+    """
+    Encode a file as a base64 data URL, reading it in chunks so the raw file
+    is never held in memory next to its encoded copy.
+    """
+    url = bytearray(f"data:{mime_type};base64,".encode("utf-8"))
+    with open(file_path, "rb") as f:
+        # Chunks are a multiple of 3 bytes, so each encodes without padding
+        while chunk := f.read(BASE64_READ_CHUNK_SIZE):
+            url += base64.b64encode(chunk)
+    return url.decode("utf-8")
+
+
 def normalized_to_legacy_format(chat_id: str, embed_files_as_base64: bool = False) -> Dict:
     """
     Convert normalized chat_message tables to legacy JSON blob format.
@@ -50,211 +281,181 @@ def normalized_to_legacy_format(chat_id: str, embed_files_as_base64: bool = Fals
     the legacy chat.chat blob for message content. All messages should have been migrated during the
     backfill migration, including fields like modelIdx, userContext, lastSentence
     stored in the meta column.
+
+    Results are cached per chat (except exports) and reused while the chat and its
+    messages are unchanged; callers always get a fresh dict.
     """
-    from open_webui.models.chats import Chat
 
     with get_db() as db:
         chat = db.query(Chat).filter_by(id=chat_id).first()
         if not chat:
             return {}
 
-        # Get all messages for this chat, ordered by creation time
-        messages_query = db.query(ChatMessage).filter_by(chat_id=chat_id).order_by(ChatMessage.created_at.asc())
-        all_messages = messages_query.all()
-
-        # Get all attachments
-        message_ids = [m.id for m in all_messages]
+        version = None
+        if not embed_files_as_base64:
+            newest_message_at, message_count = (
+                db.query(func.max(ChatMessage.updated_at), func.count(ChatMessage.id))
+                .filter(ChatMessage.chat_id == chat_id)
+                .one()
+            )
+            version = (chat.updated_at, chat.active_message_id, newest_message_at, message_count)
+            cached = _legacy_format_cache.get(chat_id)
+            if cached and cached[0] == version and time.time() - cached[2] < LEGACY_FORMAT_CACHE_TTL:
+                return orjson.loads(cached[1])
+
+        # Get all attachments - join on chat_id rather than binding every message id in an IN list
         attachments_map: Dict[str, List[Dict]] = {}
-        if message_ids:
-            attachments = db.query(ChatMessageAttachment).filter(ChatMessageAttachment.message_id.in_(message_ids)).all()
-            for att in attachments:
-                msg_id_str = str(att.message_id) if att.message_id else None
-                if msg_id_str:
-                    if msg_id_str not in attachments_map:
-                        attachments_map[msg_id_str] = []
-                    attachments_map[msg_id_str].append({
-                        "type": str(att.type) if att.type else "file",
-                        "file_id": str(att.file_id) if att.file_id else None,
-                        "url": str(att.url) if att.url else None,
-                        "mime_type": str(att.mime_type) if att.mime_type else None,
-                        "size_bytes": int(att.size_bytes) if att.size_bytes else None,
-                        "metadata": att.meta if att.meta else {}
-                    })
-
-        # Batch fetch all children relationships to avoid N+1 queries
-        children_map: Dict[str, List[ChatMessage]] = {}
-        if message_ids:
-            all_children = db.query(ChatMessage).filter(
-                ChatMessage.parent_id.in_(message_ids)
-            ).order_by(
-                ChatMessage.position.asc(),
-                ChatMessage.created_at.asc()
-            ).all()
-            for child in all_children:
-                if child.parent_id:
-                    parent_id_str = str(child.parent_id)
-                    if parent_id_str not in children_map:
-                        children_map[parent_id_str] = []
-                    children_map[parent_id_str].append(child)
-
-        # Build message map (old format) - use OrderedDict to preserve creation order
-        messages_dict: OrderedDict[str, Dict] = OrderedDict()
-
-        # Helper to get model name from model_id
-        def get_model_name(model_id: Optional[str]) -> Optional[str]:
-            if not model_id:
-                return None
+        attachments = (
+            db.query(ChatMessageAttachment)
+            .join(ChatMessage, ChatMessage.id == ChatMessageAttachment.message_id)
+            .filter(ChatMessage.chat_id == chat_id)
+            .all()
+        )
+        for att in attachments:
+            msg_id_str = att.message_id or None
+            if msg_id_str:
+                if msg_id_str not in attachments_map:
+                    attachments_map[msg_id_str] = []
+                file_id = att.file_id or None
+                if not file_id and att.url and "/files/" in att.url:
+                    # Extract file_id from URL format: /api/v1/files/{file_id}/content or http://host/api/v1/files/{file_id}/content
+                    file_id = att.url.split("/files/")[1].split("/")[0] or None
+                attachments_map[msg_id_str].append({
+                    "type": att.type or "file",
+                    "file_id": file_id,
+                    "url": att.url or None,
+                    "mime_type": att.mime_type or None,
+                    "size_bytes": att.size_bytes or None,
+                    "metadata": att.meta if att.meta else {}
+                })
+
+        # Prefetch the file records and knowledge collections referenced by the attachments
+        # in one query each (only the columns used below - file.data can be large)
+        files_by_id = {}
+        file_ids = {
+            a["file_id"]
+            for atts in attachments_map.values()
+            for a in atts
+            if a["file_id"] and a["type"] in ("file", "image")
+        }
+        if file_ids:
             try:
-                from open_webui.models.models import Models
-                model = Models.get_model_by_id(model_id)
-                if model and hasattr(model, 'name'):
-                    return model.name or model_id
-                return model_id
-            except Exception:
-                return model_id
-
-        # Helper to extract lastSentence from content
-        def get_last_sentence(content: str) -> Optional[str]:
-            if not content:
-                return None
-            # Simple extraction: get last sentence (ending with . ! ?)
-            sentences = re.split(r'([.!?]+)', content)
-            if len(sentences) >= 2:
-                # Get last complete sentence
-                last = ''.join(sentences[-2:]).strip()
-                return last if last else None
-            return content.strip() if content.strip() else None
-
-        # Helper to reconstruct file_obj from attachment metadata when file record is not found
-        def reconstruct_file_from_metadata(file_id: str, att_type: str, att_meta: dict, embed_files_as_base64: bool) -> dict:
-            """Reconstruct file object from attachment metadata when file record is unavailable."""
-            file_obj = {
-                "id": file_id,
-                "type": att_type,
-            }
-            # Copy metadata from attachment
-            if att_meta:
-                if "name" in att_meta:
-                    file_obj["name"] = att_meta["name"]
-                if "description" in att_meta:
-                    file_obj["description"] = att_meta["description"]
-                if "status" in att_meta:
-                    file_obj["status"] = att_meta["status"]
-                if "collection" in att_meta:
-                    file_obj["collection"] = att_meta["collection"]
-                # Build meta dict from attachment metadata
-                file_obj["meta"] = {}
-                # Include all relevant meta fields
-                for key in ["name", "content_type", "size", "data", "collection_name"]:
-                    if key in att_meta:
-                        file_obj["meta"][key] = att_meta[key]
-            if not embed_files_as_base64:
-                file_obj["url"] = f"/api/v1/files/{file_id}/content"
-            return file_obj
+                files_by_id = {
+                    f.id: f
+                    for f in db.query(
+                        File.id, File.filename, File.path, File.meta, File.created_at, File.updated_at
+                    ).filter(File.id.in_(file_ids))
+                }
+            except Exception as e:
+                log.warning("normalized_to_legacy_format: Failed to prefetch file records: %s", e)
+
+        knowledge_by_id = {}
+        collection_names = set()
+        for atts in attachments_map.values():
+            for a in atts:
+                file_record = files_by_id.get(a["file_id"])
+                att_meta = a["metadata"] if isinstance(a["metadata"], dict) else {}
+                if file_record is None or "collection" in att_meta:
+                    continue
+                collection_name = att_meta.get("collection_name") or (file_record.meta or {}).get("collection_name")
+                if collection_name:
+                    collection_names.add(collection_name)
+        if collection_names:
+            try:
+                knowledge_by_id = {
+                    k.id: k
+                    for k in db.query(Knowledge.id, Knowledge.name, Knowledge.description).filter(
+                        Knowledge.id.in_(collection_names)
+                    )
+                }
+            except Exception as e:
+                log.warning("normalized_to_legacy_format: Failed to prefetch knowledge collections: %s", e)
+
+        # Stream the chat's messages in creation order instead of materializing every ORM
+        # object at once; each row is converted in a single pass and can then be released.
+        # Anything that needs the whole chat (childrenIds, modelName) is collected as
+        # plain values and filled in after the loop. Only the columns used below are
+        # selected, as plain rows (no ORM hydration or identity map).
+        messages_query = (
+            db.query(
+                ChatMessage.id,
+                ChatMessage.parent_id,
+                ChatMessage.position,
+                ChatMessage.role,
+                ChatMessage.model_id,
+                ChatMessage.content_text,
+                ChatMessage.content_json,
+                ChatMessage.status,
+                ChatMessage.usage,
+                ChatMessage.meta,
+                ChatMessage.annotation,
+                ChatMessage.feedback_id,
+                ChatMessage.selected_model_id,
+                ChatMessage.created_at,
+            )
+            .filter(ChatMessage.chat_id == chat_id)
+            .order_by(ChatMessage.created_at.asc())
+            .yield_per(MESSAGE_FETCH_BATCH_SIZE)
+        )
+
+        # Children per parent id as (position, created_at, child_id), sorted after the loop
+        children_map: Dict[str, List[tuple]] = defaultdict(list)
+        # Assistant message dicts whose modelName is resolved after the loop
+        assistant_dicts: List[Dict] = []
+        first_user_meta = None
+        first_created_at = None
+
+        # Build message map (old format) - dicts keep insertion (creation) order
+        messages_dict: Dict[str, Dict] = {}
 
         # Build messages in creation order (ordered by created_at from query)
         # This matches the original order since messages were created sequentially
-        for msg in all_messages:
-            # Get message ID string first - needed for dict key and lookups
-            msg_id_str = str(msg.id) if msg.id else None
+        for msg in messages_query:
+            # Read the JSON columns once per row
+            meta = msg.meta
+            status = msg.status
+            usage = msg.usage
+
+            # The id/parent/role/model columns are String/Text and created_at is BigInteger,
+            # so the row values are used as-is (empty values normalized) without casting
+            msg_created_at = msg.created_at or 0
+            if first_created_at is None:
+                first_created_at = msg_created_at
+            if first_user_meta is None and msg.role == "user":
+                first_user_meta = meta or {}
+
+            # Get message ID first - needed for dict key and lookups
+            msg_id_str = msg.id
             if not msg_id_str:
                 continue  # Skip messages without valid IDs
 
-            # Build childrenIds list from pre-fetched children map
-            children = children_map.get(msg_id_str, [])
-            children_ids = [str(c.id) for c in children if c.id]
+            msg_parent_id = msg.parent_id or None
+            if msg_parent_id:
+                children_map[msg_parent_id].append(
+                    (msg.position or 0, msg_created_at, msg_id_str)
+                )
 
             # Map attachments to files array with base64 embedding
             files = []
             if msg_id_str in attachments_map:
                 for att in attachments_map[msg_id_str]:
-                    # Extract file_id from URL if not directly present
+                    # file_id falls back to the one in the URL (resolved when building attachments_map)
                     file_id = att.get("file_id")
-                    if not file_id and att.get("url"):
-                        # Try to extract file_id from URL format: /api/v1/files/{file_id}/content or http://host/api/v1/files/{file_id}/content
-                        url = att.get("url")
-                        if url and "/files/" in url:
-                            parts = url.split("/files/")
-                            if len(parts) > 1:
-                                file_id = parts[1].split("/")[0]
+                    file_url = f"/api/v1/files/{file_id}/content" if file_id else None
 
                     # Preserve attachment type (image, file, collection, web_search, etc.)
                     att_type = att.get("type", "file")
                     att_meta = att.get("meta") or att.get("metadata") or {}
 
                     # For regular files, get full file record to reconstruct complete structure
-                    if file_id and att_type in ["file", "image"]:
+                    if file_id and att_type in ("file", "image"):
                         try:
-                            from open_webui.models.files import Files
-                            file_record = Files.get_file_by_id(file_id)
+                            file_record = files_by_id.get(file_id)
                             if file_record:
-                                # Start with file record data
-                                file_meta = dict(file_record.meta) if file_record.meta else {}
-
-                                # Merge attachment metadata (which may have collection info, etc.)
-                                if att_meta:
-                                    # Merge attachment meta into file meta, preserving file record data
-                                    for key, value in att_meta.items():
-                                        if key not in file_meta or value is not None:
-                                            file_meta[key] = value
-
-                                # Reconstruct full file structure matching legacy format
-                                # Start with all fields from file record and attachment metadata
-                                file_obj = {
-                                    "id": file_record.id,
-                                    "type": att_type,
-                                    "meta": file_meta,  # Already merged above
-                                    "created_at": file_record.created_at,
-                                    "updated_at": file_record.updated_at,
-                                }
-
-                                # Add name - prefer attachment meta, then file meta, then filename
-                                if "name" in att_meta:
-                                    file_obj["name"] = att_meta["name"]
-                                elif file_meta.get("name"):
-                                    file_obj["name"] = file_meta["name"]
-                                else:
-                                    file_obj["name"] = file_record.filename
-
-                                # Add description if present (from attachment or file meta)
-                                if "description" in att_meta:
-                                    file_obj["description"] = att_meta["description"]
-                                elif file_meta.get("description"):
-                                    file_obj["description"] = file_meta["description"]
-
-                                # Add status - prefer attachment meta, then file meta, then default
-                                if "status" in att_meta:
-                                    file_obj["status"] = att_meta["status"]
-                                elif file_meta.get("status"):
-                                    file_obj["status"] = file_meta["status"]
-                                else:
-                                    file_obj["status"] = "processed"  # Default
-
-                                # Add collection info if present
-                                collection_name = att_meta.get("collection_name") or file_meta.get("collection_name")
-                                if collection_name:
-                                    # Ensure collection_name is in meta
-                                    if "collection_name" not in file_obj["meta"]:
-                                        file_obj["meta"]["collection_name"] = collection_name
-
-                                    # Try to get collection details from attachment meta or database
-                                    if "collection" in att_meta:
-                                        file_obj["collection"] = att_meta["collection"]
-                                    else:
-                                        try:
-                                            from open_webui.models.knowledge import Knowledge
-                                            knowledge = db.query(Knowledge).filter_by(id=collection_name).first()
-                                            if knowledge:
-                                                file_obj["collection"] = {
-                                                    "name": knowledge.name or "",
-                                                    "description": knowledge.description or ""
-                                                }
-                                        except Exception:
-                                            pass  # Collection lookup failed, continue without it
-
+                                file_obj = file_record_to_file_obj(file_record, att_type, att_meta, knowledge_by_id)
                                 # Add URL for API responses (not for base64 exports)
                                 if not embed_files_as_base64:
-                                    file_obj["url"] = f"/api/v1/files/{file_id}/content"
+                                    file_obj["url"] = file_url
                             else:
                                 # File record not found, reconstruct from attachment metadata
                                 file_obj = reconstruct_file_from_metadata(file_id, att_type, att_meta, embed_files_as_base64)
@@ -262,28 +463,9 @@ def normalized_to_legacy_format(chat_id: str, embed_files_as_base64: bool = Fals
                             log.warning(f"normalized_to_legacy_format: Failed to get file record {file_id}: {e}, using attachment metadata")
                             # Fallback: reconstruct from attachment metadata
                             file_obj = reconstruct_file_from_metadata(file_id, att_type, att_meta, embed_files_as_base64)
-                    elif att_type == "collection" and att_meta:
-                        # For collections, reconstruct from attachment meta (excluding files and data.file_ids)
-                        file_obj = {
-                            "type": "collection",
-                        }
-                        # Copy collection fields from meta, but exclude files and data.file_ids
-                        for key in ["id", "name", "description", "type", "status", "user", "collection_name", "collection_names", "user_id", "access_control", "created_at", "updated_at"]:
-                            if key in att_meta:
-                                file_obj[key] = att_meta[key]
-                        # Copy data but exclude file_ids
-                        if "data" in att_meta and isinstance(att_meta["data"], dict):
-                            data_copy = {k: v for k, v in att_meta["data"].items() if k != "file_ids"}
-                            if data_copy:  # Only add data if there are other fields besides file_ids
-                                file_obj["data"] = data_copy
-                    elif att_type == "web_search" and att_meta:
-                        # For web_search, reconstruct from attachment meta
-                        file_obj = {
-                            "type": "web_search",
-                        }
-                        for key in ["collection_name", "name", "urls", "docs", "type"]:
-                            if key in att_meta:
-                                file_obj[key] = att_meta[key]
+                    elif att_meta and att_type in ATTACHMENT_META_BUILDERS:
+                        # Collections and web searches are rebuilt from attachment meta alone
+                        file_obj = ATTACHMENT_META_BUILDERS[att_type](att_meta)
                     else:
                         # Fallback for other types
                         file_obj = {
@@ -295,45 +477,40 @@ def normalized_to_legacy_format(chat_id: str, embed_files_as_base64: bool = Fals
                         if file_id:
                             file_obj["id"] = file_id
                             if not embed_files_as_base64:
-                                file_obj["url"] = f"/api/v1/files/{file_id}/content"
+                                file_obj["url"] = file_url
 
                     # Handle base64 embedding for regular files (if requested and not already handled)
                     if file_id and embed_files_as_base64 and att_type in ["file", "image"] and isinstance(file_obj, dict) and "url" not in file_obj:
                         # For exports, embed file content as base64 data URL
                         try:
-                            from open_webui.models.files import Files
-                            file_record = Files.get_file_by_id(file_id)
+                            file_record = files_by_id.get(file_id)
                             if file_record and file_record.path:
                                 file_path = Storage.get_file(file_record.path)
                                 if os.path.isfile(file_path):
-                                    with open(file_path, "rb") as f:
-                                        file_content = f.read()
-                                    base64_data = base64.b64encode(file_content).decode("utf-8")
-
                                     # Use data URL format for compatibility with old exports
                                     # Format: data:{mime_type};base64,{base64_data}
                                     # Get mime_type from attachment, file record meta, or file record mime_type column
                                     mime_type = (att.get("mime_type") or
-                                                 (file_record.meta.get("content_type") if file_record.meta else None) or
-                                                 (getattr(file_record, 'mime_type', None) if hasattr(file_record, 'mime_type') else None) or
+                                                 (file_record.meta or {}).get("content_type") or
+                                                 getattr(file_record, "mime_type", None) or
                                                  "application/octet-stream")
-                                    file_obj["url"] = f"data:{mime_type};base64,{base64_data}"
+                                    file_obj["url"] = file_to_data_url(file_path, mime_type)
 
                                 else:
                                     # File doesn't exist on disk, use file URL as fallback
-                                    file_obj["url"] = f"/api/v1/files/{file_id}/content"
+                                    file_obj["url"] = file_url
                                     log.warning(f"normalized_to_legacy_format: File {file_id} not found at path {file_path}, using file URL")
                             else:
                                 # File record not found, use file URL as fallback
-                                file_obj["url"] = f"/api/v1/files/{file_id}/content"
+                                file_obj["url"] = file_url
                                 log.warning(f"normalized_to_legacy_format: File record {file_id} not found, using file URL")
                         except Exception as e:
                             # On error, use file URL as fallback
-                            file_obj["url"] = f"/api/v1/files/{file_id}/content"
+                            file_obj["url"] = file_url
                             log.warning(f"normalized_to_legacy_format: Failed to embed file {file_id} as base64: {e}, using file URL")
                     elif file_id and not embed_files_as_base64 and isinstance(file_obj, dict) and "url" not in file_obj:
                         # For API responses, use file URL (don't embed base64)
-                        file_obj["url"] = f"/api/v1/files/{file_id}/content"
+                        file_obj["url"] = file_url
                     elif not file_id and att.get("url") and isinstance(file_obj, dict):
                         # No file_id, keep URL if present
                         file_obj["url"] = att.get("url")
@@ -344,73 +521,59 @@ def normalized_to_legacy_format(chat_id: str, embed_files_as_base64: bool = Fals
 
             # Also include any explicit files stored in message meta
             try:
-                meta_files = []
-                if msg.meta and isinstance(msg.meta, dict) and "files" in msg.meta:
-                    if isinstance(msg.meta["files"], list):
-                        meta_files = msg.meta["files"]
-                if meta_files:
-                    # Normalize meta files to legacy shape: ensure id/url/type set where possible
+                meta_files = meta.get("files") if isinstance(meta, dict) else None
+                if meta_files and isinstance(meta_files, list):
+                    # Normalize meta files to legacy shape: ensure id/url/type set where possible.
+                    # Entries are only copied when something has to change.
                     for mf in meta_files:
                         if not isinstance(mf, dict):
                             continue
-                        out = dict(mf)
                         # For collections, strip files array and data.file_ids
-                        if out.get("type") == "collection":
-                            out.pop("files", None)
-                            if isinstance(out.get("data"), dict):
-                                out["data"].pop("file_ids", None)
-                                # Remove data entirely if it's now empty
-                                if not out["data"]:
-                                    out.pop("data", None)
+                        out = strip_collection_files(mf)
                         # If URL missing but id present, provide default URL
-                        if out.get("id") and not out.get("url") and out.get("type") in ["file", "image"]:
-                            out["url"] = f"/api/v1/files/{out['id']}/content"
+                        if out.get("id") and not out.get("url") and out.get("type") in ("file", "image"):
+                            out = {**out, "url": f"/api/v1/files/{out['id']}/content"}
                         files.append(out)
                     # Deduplicate by (type, id or collection_name)
                     # Prefer files from meta (more complete) over those reconstructed from attachments
-                    # Use dict for O(1) lookups instead of O(n) list search
                     dedup_map = {}
                     for f in files:
-                        file_type = f.get("type")
-                        file_id = f.get("id")
+                        f_id = f.get("id")
                         collection_name = f.get("collection_name")
+                        key = (f.get("type"), f_id or collection_name)
 
-                        # Build deduplication key
-                        key = (file_type, file_id or collection_name)
-
-                        if key not in dedup_map:
+                        existing = dedup_map.get(key)
+                        if existing is None:
                             dedup_map[key] = f
-                        else:
-                            # Key already exists - check if we should replace with a more complete version
-                            existing = dedup_map[key]
-                            # Prefer the one with an id field (more complete)
-                            if not existing.get("id") and f.get("id"):
+                            continue
+                        # Key already exists - check if we should replace with a more complete version
+                        existing_id = existing.get("id")
+                        # Prefer the one with an id field (more complete)
+                        if not existing_id and f_id:
+                            dedup_map[key] = f
+                        # If both have id, prefer the one with more fields (likely from meta, more complete)
+                        elif existing_id and f_id and existing_id == f_id:
+                            if len(f) > len(existing):
+                                dedup_map[key] = f
+                        # If neither has id but both have collection_name, prefer the one with more fields
+                        elif not existing_id and not f_id and collection_name:
+                            if len(f) > len(existing):
                                 dedup_map[key] = f
-                            # If both have id, prefer the one with more fields (likely from meta, more complete)
-                            elif existing.get("id") and f.get("id") and existing.get("id") == f.get("id"):
-                                if len(f) > len(existing):
-                                    dedup_map[key] = f
-                            # If neither has id but both have collection_name, prefer the one with more fields
-                            elif not existing.get("id") and not f.get("id") and collection_name:
-                                if len(f) > len(existing):
-                                    dedup_map[key] = f
                     files = list(dedup_map.values())
             except Exception:
                 pass
 
             # Build message in old format
-            # Access SQLAlchemy model attributes (they're values, not Column objects at runtime)
-            msg_id = str(msg.id) if msg.id else None
-            msg_parent_id = str(msg.parent_id) if msg.parent_id else None
-            msg_role = str(msg.role) if msg.role else ""
-            msg_content_text = str(msg.content_json.get("text")) if (msg.content_json and isinstance(msg.content_json, dict) and "text" in msg.content_json) else (str(msg.content_text) if msg.content_text else "")
-            msg_model_id = str(msg.model_id) if msg.model_id else None
-            msg_created_at = int(msg.created_at) if msg.created_at else 0
+            msg_id = msg_id_str
+            msg_role = msg.role or ""
+            # content_json is JSON, so its text may be any JSON value and is still cast
+            msg_content_text = str(msg.content_json.get("text")) if (msg.content_json and isinstance(msg.content_json, dict) and "text" in msg.content_json) else (msg.content_text or "")
+            msg_model_id = msg.model_id or None
 
             message_dict = {
                 "id": msg_id,
                 "parentId": msg_parent_id,
-                "childrenIds": children_ids,
+                "childrenIds": [],
                 "role": msg_role,
                 "content": msg_content_text,
                 "model": msg_model_id,
@@ -422,23 +585,22 @@ def normalized_to_legacy_format(chat_id: str, embed_files_as_base64: bool = Fals
                 # log.debug(f"Converting message: db_id={msg.id}, db_parent_id={msg.parent_id}, "
                         #   f"converted_id={msg_id}, converted_parent_id={msg_parent_id}")
 
-            # Add modelName for assistant messages (lookup from model_id)
+            # Add modelName for assistant messages (resolved from model_id after the loop)
             if msg_role == "assistant" and msg_model_id:
-                model_name = get_model_name(msg_model_id)
-                if model_name:
-                    message_dict["modelName"] = model_name
+                message_dict["modelName"] = msg_model_id
+                assistant_dicts.append(message_dict)
 
             # Add optional fields
             if msg.content_json:
                 message_dict["content_json"] = msg.content_json
 
-            if msg.status:
-                message_dict["status"] = msg.status
-                if "statusHistory" in msg.status:
-                    message_dict["statusHistory"] = msg.status["statusHistory"]
+            if status:
+                message_dict["status"] = status
+                if "statusHistory" in status:
+                    message_dict["statusHistory"] = status["statusHistory"]
 
-            if msg.usage:
-                message_dict["usage"] = msg.usage
+            if usage:
+                message_dict["usage"] = usage
 
             # Add feedback/evaluation fields
             if msg.annotation:
@@ -448,70 +610,71 @@ def normalized_to_legacy_format(chat_id: str, embed_files_as_base64: bool = Fals
             if msg.selected_model_id:
                 message_dict["selectedModelId"] = msg.selected_model_id
 
-            # Extract fields from meta (all unmigrated fields should be here)
-            if msg.meta:
-                # Preserve modelIdx for side-by-side chats
-                if "modelIdx" in msg.meta:
-                    message_dict["modelIdx"] = msg.meta["modelIdx"]
-                if "models" in msg.meta:
-                    message_dict["models"] = msg.meta["models"]
-                # Preserve userContext if stored in meta
-                if "userContext" in msg.meta:
-                    message_dict["userContext"] = msg.meta["userContext"]
-                # Preserve lastSentence if stored in meta
-                if "lastSentence" in msg.meta:
-                    message_dict["lastSentence"] = msg.meta["lastSentence"]
-                # Preserve sources (web search, RAG citations) if stored in meta
+            # Extract fields from meta (all unmigrated fields should be here):
+            # modelIdx (side-by-side chats), models, userContext, lastSentence,
+            # sources (web search, RAG citations) and merged (MOA) metadata
+            if isinstance(meta, dict):
+                for key in META_PASSTHROUGH_KEYS:
+                    if key in meta:
+                        message_dict[key] = meta[key]
                 # Strip collections from sources to reduce payload size
-                if "sources" in msg.meta:
-                    sources = msg.meta["sources"]
-                    if isinstance(sources, list):
-                        stripped_sources = []
-                        for source in sources:
-                            if isinstance(source, dict) and "source" in source:
-                                source_copy = dict(source)
-                                if isinstance(source_copy["source"], dict) and source_copy["source"].get("type") == "collection":
-                                    source_copy["source"] = strip_collection_files(source_copy["source"])
-                                stripped_sources.append(source_copy)
-                            else:
-                                stripped_sources.append(source)
-                        message_dict["sources"] = stripped_sources
-                    else:
-                        message_dict["sources"] = sources
-                # Preserve merged (MOA) metadata if stored in meta
-                if "merged" in msg.meta:
-                    message_dict["merged"] = msg.meta["merged"]
-
-            # Compute lastSentence if still not present (for assistant messages)
-            if msg_role == "assistant" and "lastSentence" not in message_dict and msg_content_text:
-                last_sent = get_last_sentence(msg_content_text)
-                if last_sent:
-                    message_dict["lastSentence"] = last_sent
-
-            # Set done flag for assistant messages (true if usage exists, indicating completion)
-            if msg_role == "assistant" and "done" not in message_dict:
-                message_dict["done"] = bool(msg.usage)
-                # Also check status for done flag
-                if msg.status and isinstance(msg.status, dict) and "done" in msg.status:
-                    message_dict["done"] = msg.status["done"]
-
-            # userContext defaults to null for assistant messages
-            if msg_role == "assistant" and "userContext" not in message_dict:
-                message_dict["userContext"] = None
+                sources = message_dict.get("sources")
+                if isinstance(sources, list):
+                    stripped_sources = []
+                    for source in sources:
+                        if isinstance(source, dict) and "source" in source:
+                            source_copy = dict(source)
+                            if isinstance(source_copy["source"], dict) and source_copy["source"].get("type") == "collection":
+                                source_copy["source"] = strip_collection_files(source_copy["source"])
+                            stripped_sources.append(source_copy)
+                        else:
+                            stripped_sources.append(source)
+                    message_dict["sources"] = stripped_sources
+
+            if msg_role == "assistant":
+                # Compute lastSentence if meta didn't provide one
+                if "lastSentence" not in message_dict and msg_content_text:
+                    last_sent = get_last_sentence(msg_content_text)
+                    if last_sent:
+                        message_dict["lastSentence"] = last_sent
+
+                # done is true if usage exists (indicating completion), unless status says otherwise
+                done = bool(usage)
+                if isinstance(status, dict) and "done" in status:
+                    done = status["done"]
+                message_dict["done"] = done
+
+                # userContext defaults to null for assistant messages
+                if "userContext" not in message_dict:
+                    message_dict["userContext"] = None
 
             if files:
                 message_dict["files"] = files
 
             messages_dict[msg_id_str] = message_dict
 
+        # Fill childrenIds, ordered by position then creation time (stable for ties)
+        for parent_id, children in children_map.items():
+            parent = messages_dict.get(parent_id)
+            if parent is not None:
+                children.sort(key=lambda c: (c[0], c[1]))
+                parent["childrenIds"] = [c[2] for c in children]
+
+        # Resolve names for all assistant models at once (cached, at most one query)
+        if assistant_dicts:
+            model_name_map = Models.get_model_names_by_ids(
+                list({d["model"] for d in assistant_dicts})
+            )
+            for d in assistant_dicts:
+                d["modelName"] = model_name_map.get(d["model"], d["model"])
+
         # Build legacy chat structure
         chat_content = {}
 
         # Get models from first user message's meta (where it should be stored)
         # Do NOT read from chat.params - models should be at chat level, not in params
-        first_user_msg = next((m for m in all_messages if m.role == "user"), None)
-        if first_user_msg and first_user_msg.meta and "models" in first_user_msg.meta:
-            chat_content["models"] = first_user_msg.meta["models"]
+        if first_user_meta and "models" in first_user_meta:
+            chat_content["models"] = first_user_meta["models"]
         else:
             # Fallback: if no models in meta, use empty array (frontend will handle defaults)
             chat_content["models"] = []
@@ -537,109 +700,157 @@ def normalized_to_legacy_format(chat_id: str, embed_files_as_base64: bool = Fals
 
         # Build history
         current_id = str(chat.active_message_id) if chat.active_message_id else None
-        if not current_id and all_messages:
-            # Find the deepest leaf message
-            # Build a parent_id set for quick lookup
-            parent_ids = {str(c.parent_id) for c in all_messages if c.parent_id}
-            leaves = [m for m in all_messages if str(m.id) not in parent_ids]
+        if not current_id and messages_dict:
+            # Find the deepest leaf message: children_map is keyed by every parent id,
+            # so a leaf is any message that isn't a key there
+            leaves = [m for m in messages_dict.values() if m["id"] not in children_map]
             if leaves:
-                # Sort by timestamp descending and take the most recent
-                leaves.sort(key=lambda m: int(m.created_at) if m.created_at else 0, reverse=True)
-                current_id = str(leaves[0].id) if leaves[0].id else None
-
-        # Convert OrderedDict to regular dict while preserving order (Python 3.7+ preserves insertion order)
-        # Ensure messages are in creation order (already sorted by created_at query)
-        messages_dict_final = dict(messages_dict)
+                # Take the most recent (first one wins on ties, as with a stable sort)
+                current_id = max(leaves, key=lambda m: m["timestamp"])["id"]
 
+        # messages_dict is already in creation order (sorted by created_at query)
         chat_content["history"] = {
-            "messages": messages_dict_final,
+            "messages": messages_dict,
             "currentId": current_id,
-            "timestamp": int(all_messages[0].created_at) if all_messages else int(time.time())
+            "timestamp": first_created_at if first_created_at is not None else int(time.time())
         }
 
         # Build messages list (flat list format, also used by frontend)
         # This is the linear branch to currentId
         messages_list = []
         if current_id:
-            # Walk back from currentId to build the branch
-            msg_map = {str(m.id): m for m in all_messages if m.id}
-            cur = msg_map.get(str(current_id))
-            branch = []
-            while cur:
-                branch.append(cur)
-                if cur.parent_id:
-                    cur = msg_map.get(str(cur.parent_id))
-                else:
-                    break
-            branch.reverse()
-
-            for msg in branch:
-                msg_id_str = str(msg.id) if msg.id else None
-                msg_dict = messages_dict.get(msg_id_str, {}) if msg_id_str else {}
-
-                # Build message entry for messages array - should match history.messages structure
-                # Strip content, sources, and files fields to reduce bandwidth (frontend will JOIN with history.messages)
-                # Exception: Keep these fields for exports (embed_files_as_base64=True) for portability
-                msg_entry = {
-                    "id": msg_dict.get("id"),
-                    "role": msg_dict.get("role"),
-                    "timestamp": msg_dict.get("timestamp"),
-                }
-                
-                # Only include content, sources, and files for exports
-                if embed_files_as_base64:
-                    if "content" in msg_dict:
-                        msg_entry["content"] = msg_dict["content"]
-                    if "sources" in msg_dict:
-                        msg_entry["sources"] = msg_dict["sources"]
-                    if "files" in msg_dict:
-                        msg_entry["files"] = msg_dict["files"]
-
-                # Add all fields that are in history.messages
-                if "parentId" in msg_dict:
-                    msg_entry["parentId"] = msg_dict["parentId"]
-                if "childrenIds" in msg_dict:
-                    msg_entry["childrenIds"] = msg_dict["childrenIds"]
-                if "model" in msg_dict:
-                    msg_entry["model"] = msg_dict["model"]
-                if "modelName" in msg_dict:
-                    msg_entry["modelName"] = msg_dict["modelName"]
-                if "modelIdx" in msg_dict:
-                    msg_entry["modelIdx"] = msg_dict["modelIdx"]
-                if "userContext" in msg_dict:
-                    msg_entry["userContext"] = msg_dict["userContext"]
-                if "done" in msg_dict:
-                    msg_entry["done"] = msg_dict["done"]
-                if "lastSentence" in msg_dict:
-                    msg_entry["lastSentence"] = msg_dict["lastSentence"]
-                if "models" in msg_dict:
-                    msg_entry["models"] = msg_dict["models"]
-
-                # Usage goes into "usage" field
-                if msg_dict.get("usage"):
-                    msg_entry["usage"] = msg_dict["usage"]
-
-                if msg_dict.get("merged"):
-                    msg_entry["merged"] = msg_dict["merged"]
-
-                # Add feedback/evaluation fields
-                if "annotation" in msg_dict:
-                    msg_entry["annotation"] = msg_dict["annotation"]
-                if "feedbackId" in msg_dict:
-                    msg_entry["feedbackId"] = msg_dict["feedbackId"]
-                if "selectedModelId" in msg_dict:
-                    msg_entry["selectedModelId"] = msg_dict["selectedModelId"]
-
-                messages_list.append(msg_entry)
+            # Walk back from currentId to build the branch root-first, following the
+            # string parentIds already stored in messages_dict
+            branch = deque()
+            cid = current_id
+            while cid and cid in messages_dict:
+                branch.appendleft(cid)
+                cid = messages_dict[cid]["parentId"]
+
+            # Build message entries for messages array - should match history.messages structure
+            # Strip content, sources, and files fields to reduce bandwidth (frontend will JOIN with history.messages)
+            # Exception: Keep these fields for exports (embed_files_as_base64=True) for portability
+            entry_keys = BRANCH_ENTRY_KEYS | BRANCH_EXPORT_KEYS if embed_files_as_base64 else BRANCH_ENTRY_KEYS
+            for cid in branch:
+                messages_list.append({
+                    k: v
+                    for k, v in messages_dict[cid].items()
+                    if k in entry_keys and (v or k not in BRANCH_TRUTHY_KEYS)
+                })
 
         chat_content["messages"] = messages_list
 
         # Title
         chat_content["title"] = chat.title or "New Chat"
 
+        if version is not None:
+            last_change = max(chat.updated_at or 0, newest_message_at or 0)
+            if time.time() - last_change >= LEGACY_FORMAT_CACHE_SETTLE:
+                _cache_legacy_format(chat_id, version, chat_content)
+
         return chat_content
 
 
+def iter_legacy_format_ndjson(chat_info: Dict, chat_content: Dict) -> Iterator[bytes]:
+    """
+    Encode a chat in the legacy format as newline-delimited JSON, one record per line,
+    so large chats are serialized and sent incrementally instead of as one document:
+
+    - {"type": "chat", "chat": {...}} - the chat row fields plus the legacy blob
+      without its message collections (history keeps currentId/timestamp)
+    - {"type": "message", "message": {...}} - one per history.messages entry
+    - {"type": "branch", "message": {...}} - one per flat messages entry (current branch)
+
+    Clients rebuild history.messages (keyed by id) and messages (in order) from the lines.
+    """
+    history = chat_content.get("history") or {}
+    header_content = {k: v for k, v in chat_content.items() if k not in ("history", "messages")}
+    header_content["history"] = {k: v for k, v in history.items() if k != "messages"}
+
+    yield orjson.dumps(
+        {"type": "chat", "chat": {**chat_info, "chat": header_content}},
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE,
+    )
+    for message in (history.get("messages") or {}).values():
+        yield orjson.dumps(
+            {"type": "message", "message": message},
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE,
+        )
+    for message in chat_content.get("messages") or []:
+        yield orjson.dumps(
+            {"type": "branch", "message": message},
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE,
+        )
+
+
+def base64_sha256(base64_data: str) -> str:
+    """
+    SHA-256 hex digest of the decoded base64 data, decoding chunk by chunk so the
+    whole file is never held in memory at once.
+    """
+    digest = hashlib.sha256()
+    try:
+        # Chunks are a multiple of 4 characters, so each decodes on its own
+        for i in range(0, len(base64_data), BASE64_DECODE_CHUNK_SIZE):
+            digest.update(base64.b64decode(base64_data[i:i + BASE64_DECODE_CHUNK_SIZE], validate=True))
+    except binascii.Error:
+        # Data with whitespace or other non-alphabet characters (which b64decode skips)
+        # doesn't split on 4-character boundaries; decode it in one go instead
+        return hashlib.sha256(base64.b64decode(base64_data)).hexdigest()
+    return digest.hexdigest()
+
+
+def parse_embedded_file(file_item: dict) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Return (base64_data, mime_type) for a file embedded as a data URL
+    (data:{mime_type};base64,{data}) or with a separate base64 field.
+    base64_data is None if the file isn't embedded.
+    """
+    url = file_item.get("url", "")
+    base64_data = None
+    mime_type = file_item.get("mime_type")
+
+    # Check for data URL format
+    if url and url.startswith("data:"):
+        header, sep, data = url.partition(",")
+        if sep:
+            base64_data = data
+            # Extract mime type from header (whatever precedes the first ; or :)
+            mime_type = DATA_URL_HEADER_RE.match(header).group(1)
+        else:
+            log.warning("legacy_to_normalized_format: Data URL doesn't have expected format (no comma)")
+
+    # Fallback to separate base64 field (for backwards compatibility)
+    if not base64_data and "base64" in file_item:
+        base64_data = file_item["base64"]
+
+    return base64_data, mime_type
+
+
+def sort_messages_for_import(messages: Dict, root_ids: List[str], children_ids: Dict[str, List[str]]) -> List[tuple]:
+    """
+    Sort messages so parents are processed before children, using Kahn's algorithm:
+    every message has at most one parent, so the roots are seeded first and each
+    processed message releases its children (O(messages) instead of repeated passes).
+    Returns (msg_id, msg_data) pairs.
+    """
+    sorted_msgs = []
+    queue = deque(root_ids)
+    while queue:
+        msg_id = queue.popleft()
+        sorted_msgs.append((msg_id, messages[msg_id]))
+        queue.extend(children_ids.get(msg_id, ()))
+
+    # Messages never reached from a root have circular parent refs; add them anyway
+    if len(sorted_msgs) < len(messages):
+        placed = {msg_id for msg_id, _ in sorted_msgs}
+        sorted_msgs.extend(
+            (msg_id, msg_data) for msg_id, msg_data in messages.items() if msg_id not in placed
+        )
+
+    return sorted_msgs
+
+
 def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids: bool = False) -> None:
     """
     Convert legacy JSON blob format to normalized chat_message tables.
@@ -648,13 +859,21 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
     Note: This should only be called when we receive an update, not during read operations.
     The middleware already handles message creation/updates during streaming.
     """
-    from open_webui.models.chat_messages import ChatMessages, MessageCreateForm
+    try:
+        _legacy_to_normalized_format(chat_id, legacy_chat, regenerate_ids)
+    finally:
+        # Every path (including early returns and failures part-way through) may have
+        # written to the chat, so never leave a cached legacy representation behind
+        invalidate_legacy_format_cache(chat_id)
+
 
+def _legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids: bool) -> None:
     # Handle double nesting: frontend sends chat.chat.history, so we need to unwrap if needed
     if "chat" in legacy_chat and isinstance(legacy_chat["chat"], dict):
         legacy_chat = legacy_chat["chat"]
 
-    log.debug(f"legacy_to_normalized_format: Processing chat {chat_id}, legacy_chat keys: {list(legacy_chat.keys()) if isinstance(legacy_chat, dict) else 'not a dict'}")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("legacy_to_normalized_format: Processing chat %s, legacy_chat keys: %s", chat_id, list(legacy_chat.keys()) if isinstance(legacy_chat, dict) else 'not a dict')
 
     # Legacy format includes BOTH history.messages (dict) AND messages (flat list)
     # The history.messages dict contains ALL messages (including siblings)
@@ -667,15 +886,16 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
     # Store history.messages for content lookups (in case messages array lacks content)
     history_messages_dict = messages if isinstance(messages, dict) else {}
 
-    log.debug(f"legacy_to_normalized_format: history keys: {list(history.keys()) if isinstance(history, dict) else 'not a dict'}")
-    log.debug(f"legacy_to_normalized_format: messages type: {type(messages)}, length: {len(messages) if isinstance(messages, (dict, list)) else 'N/A'}")
-    log.debug(f"legacy_to_normalized_format: current_id: {current_id}")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("legacy_to_normalized_format: history keys: %s", list(history.keys()) if isinstance(history, dict) else 'not a dict')
+        log.debug("legacy_to_normalized_format: messages type: %s, length: %s", type(messages), len(messages) if isinstance(messages, (dict, list)) else 'N/A')
+        log.debug("legacy_to_normalized_format: current_id: %s", current_id)
 
     # If history.messages is empty or not a dict, check if there's a flat messages list
     # This handles edge cases where history.messages might be missing but messages list exists
     if not messages or not isinstance(messages, dict):
         if "messages" in legacy_chat and isinstance(legacy_chat["messages"], list) and len(legacy_chat["messages"]) > 0:
-            log.debug(f"legacy_to_normalized_format: Converting messages list to dict format (found {len(legacy_chat['messages'])} messages in list)")
+            log.debug("legacy_to_normalized_format: Converting messages list to dict format (found %s messages in list)", len(legacy_chat['messages']))
             # Convert flat messages list to history.messages dict format
             # If messages array lacks content, try to look it up from history.messages if available
             messages = {}
@@ -687,20 +907,20 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
                         history_msg = history_messages_dict[msg_id]
                         if ("content" not in msg or msg.get("content") is None) and "content" in history_msg:
                             msg["content"] = history_msg["content"]
-                            log.debug(f"legacy_to_normalized_format: Looked up content for message {msg_id} from history.messages")
+                            log.debug("legacy_to_normalized_format: Looked up content for message %s from history.messages", msg_id)
                         if ("sources" not in msg or msg.get("sources") is None) and "sources" in history_msg:
                             msg["sources"] = history_msg["sources"]
-                            log.debug(f"legacy_to_normalized_format: Looked up sources for message {msg_id} from history.messages")
+                            log.debug("legacy_to_normalized_format: Looked up sources for message %s from history.messages", msg_id)
                         if ("files" not in msg or msg.get("files") is None) and "files" in history_msg:
                             msg["files"] = history_msg["files"]
-                            log.debug(f"legacy_to_normalized_format: Looked up files for message {msg_id} from history.messages")
+                            log.debug("legacy_to_normalized_format: Looked up files for message %s from history.messages", msg_id)
                     messages[msg_id] = msg
             # Use the last message's ID as current_id if not set
             if not current_id and legacy_chat["messages"]:
                 last_msg = legacy_chat["messages"][-1]
                 if isinstance(last_msg, dict) and "id" in last_msg:
                     current_id = str(last_msg["id"])
-                    log.debug(f"legacy_to_normalized_format: Set current_id from messages list: {current_id}")
+                    log.debug("legacy_to_normalized_format: Set current_id from messages list: %s", current_id)
         else:
             log.warning(f"legacy_to_normalized_format: No messages found. history.messages: {type(messages)}, messages list exists: {'messages' in legacy_chat if isinstance(legacy_chat, dict) else False}")
 
@@ -710,68 +930,116 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
                   f"history keys: {list(history.keys()) if isinstance(history, dict) else 'not a dict'}")
         return
 
+    # Normalize message ids, parent ids and the current id to strings once up front
+    messages = {str(msg_id): msg_data for msg_id, msg_data in messages.items()}
+    current_id = str(current_id) if current_id else None
+    # ...and index the tree in the same pass: each message's parent id, the roots
+    # (no parent, or a parent outside this import) and the children of every parent
+    parent_ids: Dict[str, Optional[str]] = {}
+    root_ids: List[str] = []
+    children_ids: Dict[str, List[str]] = defaultdict(list)
+    for msg_id, msg_data in messages.items():
+        parent_id = msg_data.get("parentId") if isinstance(msg_data, dict) else None
+        if parent_id is not None:
+            parent_id = str(parent_id)
+        parent_ids[msg_id] = parent_id
+        if not parent_id or parent_id not in messages:
+            root_ids.append(msg_id)
+        else:
+            children_ids[parent_id].append(msg_id)
+
     # If regenerating IDs, prepare a deterministic mapping old_id -> new_id
     id_map: Dict[str, str] = {}
     if regenerate_ids:
-        for old_id in messages.keys():
-            old_id_str = str(old_id)
-            if old_id_str not in id_map:
-                id_map[old_id_str] = str(uuid.uuid4())
+        for old_id in messages:
+            id_map[old_id] = str(uuid.uuid4())
         # Map current_id as well
-        if current_id:
-            cur_str = str(current_id)
-            if cur_str not in id_map:
-                id_map[cur_str] = str(uuid.uuid4())
+        if current_id and current_id not in id_map:
+            id_map[current_id] = str(uuid.uuid4())
 
-    log.debug(f"legacy_to_normalized_format: Processing {len(messages)} messages, current_id: {current_id}")
+    log.debug("legacy_to_normalized_format: Processing %s messages, current_id: %s", len(messages), current_id)
 
     # Sort messages to ensure parents are created before children
-    # Process messages without parents first, then messages whose parents have been processed
-    def sort_messages_for_import(messages_dict):
-        """Sort messages so parents are processed before children."""
-        sorted_msgs = []
-        processed_ids = set()
-        remaining = dict(messages_dict)
-
-        # First pass: add messages without parents
-        for msg_id, msg_data in list(remaining.items()):
-            parent_id = msg_data.get("parentId")
-            if not parent_id or parent_id not in messages_dict:
-                sorted_msgs.append((msg_id, msg_data))
-                processed_ids.add(str(msg_id))
-                del remaining[msg_id]
-
-        # Subsequent passes: add messages whose parents have been processed
-        max_iterations = len(messages_dict)  # Safety limit
-        iteration = 0
-        while remaining and iteration < max_iterations:
-            iteration += 1
-            progress_made = False
-            for msg_id, msg_data in list(remaining.items()):
-                parent_id = msg_data.get("parentId")
-                parent_id_str = str(parent_id) if parent_id else None
-                if not parent_id_str or parent_id_str in processed_ids:
-                    sorted_msgs.append((msg_id, msg_data))
-                    processed_ids.add(str(msg_id))
-                    del remaining[msg_id]
-                    progress_made = True
-            if not progress_made:
-                # If no progress, add remaining messages anyway (might have circular refs or missing parents)
-                for msg_id, msg_data in remaining.items():
-                    sorted_msgs.append((msg_id, msg_data))
-                break
-
-        return sorted_msgs
-
-    sorted_messages = sort_messages_for_import(messages)
+    sorted_messages = sort_messages_for_import(messages, root_ids, children_ids)
+
+    # Parse and hash every embedded (base64) file up front, then look up the files that
+    # already exist with one query per batch of hashes instead of one per attachment.
+    # Key: (message id, index in its files list), Value: (base64_data, mime_type, sha256),
+    # or None if the data couldn't be decoded
+    embedded_files: Dict[tuple, Optional[tuple]] = {}
+    for msg_id, msg_data in sorted_messages:
+        if not isinstance(msg_data, dict):
+            continue
+        for idx, file_item in enumerate(msg_data.get("files") or []):
+            if not isinstance(file_item, dict) or file_item.get("type", "file") in ("collection", "web_search"):
+                continue
+            base64_data, mime_type = parse_embedded_file(file_item)
+            if not base64_data:
+                continue
+            try:
+                # Calculate hash if not provided
+                file_hash = file_item.get("hash") or base64_sha256(base64_data)
+                embedded_files[(msg_id, idx)] = (base64_data, mime_type, file_hash)
+            except Exception as e:
+                log.warning("legacy_to_normalized_format: Failed to decode base64 file in message %s: %s", msg_id, e)
+                embedded_files[(msg_id, idx)] = None
+
+    hash_to_file_id: Dict[str, str] = {}
+    chat_user_id = None
+    if embedded_files:
+        hashes = list({embedded[2] for embedded in embedded_files.values() if embedded})
+        with get_db() as db:
+            for i in range(0, len(hashes), EXISTING_FETCH_BATCH_SIZE):
+                for file_id, file_hash in db.query(File.id, File.hash).filter(
+                    File.hash.in_(hashes[i:i + EXISTING_FETCH_BATCH_SIZE])
+                ):
+                    hash_to_file_id[file_hash] = file_id
+        # New files are owned by the chat's user
+        chat = Chats.get_chat_by_id(chat_id)
+        chat_user_id = chat.user_id if chat else None
 
     # Update/create messages from the legacy format
     # This handles both updates to existing messages (e.g., edits) and creation of new messages (e.g., Save as Copy)
+    # Rows are collected here and written in bulk after the loop (one transaction)
     processed_count = 0
     error_count = 0
+    to_update: List[Dict] = []
+    to_insert: List[Dict] = []
+    attachments_to_insert: List[Dict] = []
+    now = int(time.time())
+
+    # Fetch the existing messages (meta and position are all the update path needs) in
+    # batched IN queries instead of one get_message_by_id per message
+    existing_map: Dict[str, tuple] = {}
+    if not regenerate_ids:
+        candidate_ids = [msg_id for msg_id in messages if msg_id]
+        with get_db() as db:
+            for i in range(0, len(candidate_ids), EXISTING_FETCH_BATCH_SIZE):
+                for row in db.query(ChatMessage.id, ChatMessage.meta, ChatMessage.position).filter(
+                    ChatMessage.id.in_(candidate_ids[i:i + EXISTING_FETCH_BATCH_SIZE])
+                ):
+                    existing_map[row.id] = row
+
+    # Highest sibling position per parent_id, loaded on first use and advanced as new
+    # messages are assigned positions (mirrors insert_message's per-insert MAX query)
+    sibling_positions: Optional[Dict[Optional[str], int]] = None
+
+    def next_sibling_position(parent_id: Optional[str]) -> int:
+        nonlocal sibling_positions
+        if sibling_positions is None:
+            with get_db() as db:
+                sibling_positions = dict(
+                    db.query(ChatMessage.parent_id, func.max(func.coalesce(ChatMessage.position, -1)))
+                    .filter(ChatMessage.chat_id == chat_id)
+                    .group_by(ChatMessage.parent_id)
+                    .all()
+                )
+        position = (sibling_positions.get(parent_id) or -1) + 1
+        sibling_positions[parent_id] = max(position, sibling_positions.get(parent_id, -1))
+        return position
+
     for msg_id, msg_data in sorted_messages:
-        # Convert msg_id to string for consistency
-        original_id_str = str(msg_id) if msg_id else None
+        original_id_str = msg_id or None
         # Determine the target id (regenerate or keep)
         msg_id_str = id_map.get(
             original_id_str, original_id_str) if original_id_str else None
@@ -792,25 +1060,38 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
             history_msg = history_messages_dict[original_id_str]
             if ("content" not in msg_data or msg_data.get("content") is None) and "content" in history_msg:
                 msg_data["content"] = history_msg["content"]
-                log.debug(f"legacy_to_normalized_format: Looked up content for message {msg_id_str} from history.messages")
+                log.debug("legacy_to_normalized_format: Looked up content for message %s from history.messages", msg_id_str)
             if ("sources" not in msg_data or msg_data.get("sources") is None) and "sources" in history_msg:
                 msg_data["sources"] = history_msg["sources"]
-                log.debug(f"legacy_to_normalized_format: Looked up sources for message {msg_id_str} from history.messages")
+                log.debug("legacy_to_normalized_format: Looked up sources for message %s from history.messages", msg_id_str)
             if ("files" not in msg_data or msg_data.get("files") is None) and "files" in history_msg:
                 msg_data["files"] = history_msg["files"]
-                log.debug(f"legacy_to_normalized_format: Looked up files for message {msg_id_str} from history.messages")
+                log.debug("legacy_to_normalized_format: Looked up files for message %s from history.messages", msg_id_str)
+
+        # Read the message fields used below once
+        role = msg_data.get("role")
+        content = msg_data.get("content")
+        content_json = msg_data.get("content_json")
+        model = msg_data.get("model")
+        usage = msg_data.get("usage")
+        raw_status = msg_data.get("status")
+        # Extract feedback/evaluation fields (frontend uses camelCase)
+        annotation = msg_data.get("annotation")
+        feedback_id = msg_data.get("feedbackId")
+        selected_model_id = msg_data.get("selectedModelId")
 
         # Check if message exists
-        existing = None if regenerate_ids else ChatMessages.get_message_by_id(msg_id_str)
+        existing = existing_map.get(msg_id_str)
 
-        log.debug(f"legacy_to_normalized_format: Processing message {msg_id_str}, role={msg_data.get('role')}, existing={existing is not None}, content_length={len(str(msg_data.get('content', '') or ''))}")
+        if log.isEnabledFor(logging.DEBUG):
+            # str() copies the whole content, so only measure it when debug is on
+            log.debug("legacy_to_normalized_format: Processing message %s, role=%s, existing=%s, content_length=%s", msg_id_str, role, existing is not None, len(str(content or '')))
 
         # Extract attachments/files and handle base64 embedded files
         attachments = []
         files = msg_data.get("files") or []  # Handle None case explicitly
-        log.debug(f"legacy_to_normalized_format: Processing {len(files)} file attachments for message {msg_id_str}")
+        log.debug("legacy_to_normalized_format: Processing %s file attachments for message %s", len(files), msg_id_str)
         for idx, file_item in enumerate(files):
-            log.debug(f"legacy_to_normalized_format: Processing file attachment {idx+1}/{len(files)}: type={file_item.get('type')}, has_url={'url' in file_item}, has_base64={'base64' in file_item}")
             file_type = file_item.get("type", "file")
 
             # Build attachment dict with full metadata preservation
@@ -847,93 +1128,37 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
             if file_type == "collection":
                 att_dict["url"] = None  # Collections don't have URLs
                 attachments.append(att_dict)
-                log.debug(f"legacy_to_normalized_format: Added collection attachment: {file_item.get('name', file_item.get('id', 'unknown'))}")
                 continue
 
             # Handle web_search files - skip file_id processing
             if file_type == "web_search":
                 att_dict["url"] = None  # Web search doesn't have file URLs
                 attachments.append(att_dict)
-                log.debug(f"legacy_to_normalized_format: Added web_search attachment: {file_item.get('name', 'unknown')}")
                 continue
 
             # Don't include URL in att_dict initially - we'll add file_id after processing
 
-            # Handle data URL format (data:image/png;base64,...) or separate base64 field
+            # Embedded files (data URL or separate base64 field) were parsed and hashed up front
             url = file_item.get("url", "")
-            base64_data = None
-            mime_type = file_item.get("mime_type")
-
-            log.debug(f"legacy_to_normalized_format: Processing file attachment, url type: {type(url)}, url starts with data: {url.startswith('data:') if url else False}, has base64 field: {'base64' in file_item}")
-
-            # Check for data URL format
-            if url and url.startswith("data:"):
+            embedded_key = (original_id_str, idx)
+            if embedded_key in embedded_files:
+                embedded = embedded_files[embedded_key]
                 try:
-                    log.debug(f"legacy_to_normalized_format: Found data URL, length: {len(url)}, preview: {url[:100]}...")
-                    # Parse data URL: data:{mime_type};base64,{data}
-                    parts = url.split(",", 1)
-                    if len(parts) == 2:
-                        header = parts[0]
-                        base64_data = parts[1]
-                        log.debug(f"legacy_to_normalized_format: Extracted base64 data, length: {len(base64_data)}, header: {header}")
-                        # Extract mime type from header
-                        if ";" in header:
-                            mime_type = header.split(";")[0].split(":")[1] if ":" in header else None
-                            log.debug(f"legacy_to_normalized_format: Extracted mime_type from header: {mime_type}")
-                        else:
-                            # Try to extract mime type without semicolon
-                            if ":" in header:
-                                mime_type = header.split(":")[1]
-                                log.debug(f"legacy_to_normalized_format: Extracted mime_type from header (no semicolon): {mime_type}")
-                    else:
-                        log.warning(f"legacy_to_normalized_format: Data URL doesn't have expected format (no comma), parts: {len(parts)}")
-                except Exception as e:
-                    log.warning(f"legacy_to_normalized_format: Failed to parse data URL: {e}", exc_info=True)
-                    url = None
-
-            # Fallback to separate base64 field (for backwards compatibility)
-            if not base64_data and "base64" in file_item:
-                base64_data = file_item["base64"]
-                log.debug(f"legacy_to_normalized_format: Using separate base64 field, length: {len(base64_data) if base64_data else 0}")
+                    if embedded is None:
+                        raise ValueError("invalid base64 data")
+                    base64_data, mime_type, file_hash = embedded
 
-            # Process base64 data if we have it
-            if base64_data:
-                log.debug(f"legacy_to_normalized_format: Processing base64 data, length: {len(base64_data)}, mime_type: {mime_type}")
-                try:
-                    log.debug(f"legacy_to_normalized_format: Decoding base64 data...")
-                    file_content = base64.b64decode(base64_data)
-                    log.debug(f"legacy_to_normalized_format: Decoded file content, size: {len(file_content)} bytes")
-                    file_hash = file_item.get("hash")
-
-                    # Calculate hash if not provided
-                    if not file_hash:
-                        log.debug(f"legacy_to_normalized_format: Calculating hash for file...")
-                        file_hash = hashlib.sha256(file_content).hexdigest()
-                        log.debug(f"legacy_to_normalized_format: Calculated hash: {file_hash[:16]}...")
-
-                    # Check if file already exists by hash (deduplication)
-                    file_id = None
-                    log.debug(f"legacy_to_normalized_format: Checking for existing file with hash {file_hash[:16]}...")
-                    with get_db() as db:
-                        from open_webui.models.files import File
-                        existing_file = db.query(File).filter_by(
-                            hash=file_hash).first()
-                        if existing_file:
-                            file_id = existing_file.id
-                            log.debug(f"legacy_to_normalized_format: Found existing file by hash {file_hash[:8]}... -> {file_id}")
-                        else:
-                            log.debug(f"legacy_to_normalized_format: No existing file found with hash {file_hash[:16]}...")
-
-                    # Create new file if not found
+                    # Reuse an existing file with the same content (deduplication),
+                    # otherwise create a new one
+                    file_id = hash_to_file_id.get(file_hash)
                     if not file_id:
-                        log.debug(f"legacy_to_normalized_format: Creating new file record...")
+                        file_content = base64.b64decode(base64_data)
                         file_id = str(uuid.uuid4())
                         filename = file_item.get("filename", f"imported_{file_id}")
                         # Generate storage filename
                         storage_filename = f"{file_id}_{filename}"
 
                         # Upload file to storage
-                        from io import BytesIO
                         file_io = BytesIO(file_content)
                         contents, file_path = Storage.upload_file(file_io, storage_filename)
 
@@ -949,19 +1174,15 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
                                 "size": len(file_content),
                             }
                         )
-                        # Get user_id from chat
-                        log.debug(f"legacy_to_normalized_format: Getting chat {chat_id} to find user_id...")
-                        chat = Chats.get_chat_by_id(chat_id)
-                        user_id = chat.user_id if chat else None
-                        log.debug(f"legacy_to_normalized_format: Chat found: {chat is not None}, user_id: {user_id}")
-                        if user_id:
-                            log.debug(f"legacy_to_normalized_format: Inserting file record for user {user_id}...")
-                            file_record = Files.insert_new_file(user_id, file_form)
+                        if chat_user_id:
+                            file_record = Files.insert_new_file(chat_user_id, file_form)
                             if file_record:
                                 file_id = file_record.id
+                                # Later attachments with the same content reuse this file
+                                hash_to_file_id[file_hash] = file_id
                                 log.info(f"legacy_to_normalized_format: Successfully created new file {file_id} from base64 (hash: {file_hash[:8]}..., size: {len(file_content)} bytes)")
                             else:
-                                log.error(f"legacy_to_normalized_format: Files.insert_new_file returned None for base64 attachment")
+                                log.error("legacy_to_normalized_format: Files.insert_new_file returned None for base64 attachment")
                                 file_id = None
                         else:
                             log.warning(f"legacy_to_normalized_format: Cannot create file - no user_id available for chat {chat_id}")
@@ -969,9 +1190,8 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
 
                     if file_id:
                         att_dict["file_id"] = file_id
-                        log.debug(f"legacy_to_normalized_format: Set attachment file_id to {file_id}")
                     else:
-                        log.warning(f"legacy_to_normalized_format: No file_id available for attachment after processing base64")
+                        log.warning("legacy_to_normalized_format: No file_id available for attachment after processing base64")
                 except Exception as e:
                     log.error(f"legacy_to_normalized_format: Failed to process base64 file: {e}", exc_info=True)
             # Extract file_id from URL if present (non-data URLs)
@@ -985,34 +1205,20 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
                 att_dict["file_id"] = file_item["file_id"]
 
             attachments.append(att_dict)
-            log.debug(f"legacy_to_normalized_format: Added attachment: type={att_dict.get('type')}, file_id={att_dict.get('file_id')}, has_url={'url' in att_dict}")
 
         # Build meta dict - only update if there's new data
         meta_update = {}
-        if "modelIdx" in msg_data:
-            meta_update["modelIdx"] = msg_data["modelIdx"]
-        if "models" in msg_data and msg_data.get("role") == "user":
+        for key in IMPORT_META_KEYS:
             # Only update models for user messages (first user message stores chat-level models)
-            meta_update["models"] = msg_data["models"]
-        # Preserve sources (web search, RAG citations) if present
-        if "sources" in msg_data:
-            meta_update["sources"] = msg_data["sources"]
-        # Preserve merged (MOA) metadata if present
-        if "merged" in msg_data:
-            meta_update["merged"] = msg_data["merged"]
-        # Preserve userContext if present
-        if "userContext" in msg_data:
-            meta_update["userContext"] = msg_data["userContext"]
-        # Preserve lastSentence if present
-        if "lastSentence" in msg_data:
-            meta_update["lastSentence"] = msg_data["lastSentence"]
-
-        # Extract feedback/evaluation fields
-        annotation = msg_data.get("annotation")
-        # Note: frontend uses camelCase
-        feedback_id = msg_data.get("feedbackId")
-        # Note: frontend uses camelCase
-        selected_model_id = msg_data.get("selectedModelId")
+            if key in msg_data and (key != "models" or role == "user"):
+                meta_update[key] = msg_data[key]
+
+        # Merge a separately provided statusHistory into status
+        status = raw_status
+        if "statusHistory" in msg_data:
+            if not status or not isinstance(status, dict):
+                status = {}
+            status["statusHistory"] = msg_data["statusHistory"]
 
         if existing:
             # Update existing message - merge meta, don't overwrite
@@ -1021,72 +1227,50 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
                            meta_update} if meta_update else existing_meta
 
             # Update parent_id if provided (for fixing parent-child relationships)
-            # Convert to string to ensure consistent format
-            parent_id = msg_data.get("parentId")
-            if parent_id is not None:
-                parent_old_str = str(parent_id)
-                parent_id = id_map.get(parent_old_str, parent_old_str) if regenerate_ids else parent_old_str
-
-            # Get content - check if content was provided in the update
-            content_text = msg_data.get("content")
-            content_provided = "content" in msg_data
-
-            # Handle statusHistory - merge with existing status if needed
-            status_update = msg_data.get("status")
-            if "statusHistory" in msg_data and status_update:
-                # If statusHistory is provided separately, merge it into status
-                if not isinstance(status_update, dict):
-                    status_update = {}
-                status_update["statusHistory"] = msg_data["statusHistory"]
-            elif "statusHistory" in msg_data:
-                # statusHistory provided but no status dict - create one
-                status_update = {"statusHistory": msg_data["statusHistory"]}
-
-            # Update the message
-            try:
-                result = ChatMessages.update_message(
-                    msg_id_str,
-                    content_text=content_text if content_provided else None,
-                    content_json=msg_data.get("content_json"),
-                    model_id=msg_data.get("model"),
-                    status=status_update,
-                    usage=msg_data.get("usage"),
-                    meta=merged_meta if merged_meta else None,
-                    parent_id=parent_id,
-                    annotation=annotation,
-                    feedback_id=feedback_id,
-                    selected_model_id=selected_model_id
-                )
-
-                if result is None:
-                    log.error(f"legacy_to_normalized_format: Failed to update message {msg_id_str} - update_message returned None")
-                    error_count += 1
-                else:
-                    log.debug(f"legacy_to_normalized_format: Successfully updated message {msg_id_str}, content_provided={content_provided}, content_length={len(content_text or '') if content_provided else 0}")
-                    processed_count += 1
-            except Exception as e:
-                log.error(f"legacy_to_normalized_format: Exception updating message {msg_id_str}: {str(e)}", exc_info=True)
-                error_count += 1
+            parent_id = parent_ids[original_id_str]
+            if parent_id is not None and regenerate_ids:
+                parent_id = id_map.get(parent_id, parent_id)
+
+            # Queue the update - same semantics as ChatMessages.update_message: only
+            # fields that were provided (not None) are written
+            update_row = {"id": msg_id_str, "updated_at": now}
+            if content is not None:
+                update_row["content_text"] = content
+            for column, value in (
+                ("content_json", content_json),
+                ("model_id", model),
+                ("status", status),
+                ("parent_id", parent_id),
+                ("annotation", annotation),
+                ("feedback_id", feedback_id),
+                ("selected_model_id", selected_model_id),
+            ):
+                if value is not None:
+                    update_row[column] = value
+            if usage is not None:
+                cost = extract_cost_from_usage(usage)
+                update_row["usage"] = usage
+                update_row["cost"] = Decimal(str(cost)) if cost is not None else None
+                (
+                    update_row["input_tokens"],
+                    update_row["output_tokens"],
+                    update_row["reasoning_tokens"],
+                ) = extract_tokens_from_usage(usage)
+            if merged_meta:
+                update_row["meta"] = merged_meta
+                # If modelIdx is in meta and position doesn't match, update position
+                if "modelIdx" in merged_meta and existing.position != merged_meta.get("modelIdx"):
+                    update_row["position"] = merged_meta.get("modelIdx")
+            to_update.append(update_row)
         else:
             # Create new message (e.g., during import or "Save as Copy")
-            # Convert parentId to string to ensure consistent format
-            parent_id = msg_data.get("parentId")
-            if parent_id is not None:
-                parent_old_str = str(parent_id)
-                parent_id = id_map.get(parent_old_str, parent_old_str) if regenerate_ids else parent_old_str
+            parent_id = parent_ids[original_id_str]
+            if parent_id is not None and regenerate_ids:
+                parent_id = id_map.get(parent_id, parent_id)
 
             # msg_id_str already set to regenerated or original id
 
-            # Handle statusHistory for new messages
-            status_for_insert = msg_data.get("status")
-            if "statusHistory" in msg_data and status_for_insert:
-                # If statusHistory is provided separately, merge it into status
-                if not isinstance(status_for_insert, dict):
-                    status_for_insert = {}
-                status_for_insert["statusHistory"] = msg_data["statusHistory"]
-            elif "statusHistory" in msg_data:
-                # statusHistory provided but no status dict - create one
-                status_for_insert = {"statusHistory": msg_data["statusHistory"]}
+            status_for_insert = status
 
             # Extract timestamp from message data for import (preserve original creation time)
             # IMPORTANT: Detect and convert milliseconds to seconds (timestamps > year 2100 are likely milliseconds)
@@ -1097,7 +1281,7 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
                     # Convert milliseconds to seconds if timestamp is too large (year 2100 = 4102444800)
                     if msg_created_at > 4102444800:
                         msg_created_at = msg_created_at // 1000
-                        log.debug(f"legacy_to_normalized_format: Converted message timestamp from milliseconds to seconds for {msg_id_str}")
+                        log.debug("legacy_to_normalized_format: Converted message timestamp from milliseconds to seconds for %s", msg_id_str)
                 except (ValueError, TypeError):
                     log.warning(f"legacy_to_normalized_format: Invalid timestamp value for message {msg_id_str}, using current time")
             elif "created_at" in msg_data and msg_data["created_at"]:
@@ -1106,78 +1290,106 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
                     # Convert milliseconds to seconds if timestamp is too large (year 2100 = 4102444800)
                     if msg_created_at > 4102444800:
                         msg_created_at = msg_created_at // 1000
-                        log.debug(f"legacy_to_normalized_format: Converted message created_at from milliseconds to seconds for {msg_id_str}")
+                        log.debug("legacy_to_normalized_format: Converted message created_at from milliseconds to seconds for %s", msg_id_str)
                 except (ValueError, TypeError):
                     log.warning(f"legacy_to_normalized_format: Invalid created_at value for message {msg_id_str}, using current time")
 
-            # Create the message - this handles both user and assistant messages during import
+            # Queue the message - this handles both user and assistant messages during import
             try:
-                inserted_msg = ChatMessages.insert_message(
-                    chat_id,
-                    MessageCreateForm(
-                        parent_id=parent_id,
-                        role=msg_data.get("role"),
-                        content_text=msg_data.get("content"),
-                        content_json=msg_data.get("content_json"),
-                        model_id=msg_data.get("model"),
-                        attachments=attachments if attachments else None,
-                        meta=meta_update if meta_update else None,
-                        annotation=annotation,
-                        feedback_id=feedback_id,
-                        selected_model_id=selected_model_id
-                    ),
-                    message_id=msg_id_str,
-                    created_at=msg_created_at
+                form = MessageCreateForm(
+                    parent_id=parent_id,
+                    role=role,
+                    content_text=content,
+                    content_json=content_json,
+                    model_id=model,
+                    attachments=attachments if attachments else None,
+                    meta=meta_update if meta_update else None,
+                    annotation=annotation,
+                    feedback_id=feedback_id,
+                    selected_model_id=selected_model_id
                 )
-
-                # Update status with statusHistory if needed (insert_message doesn't accept status)
-                if status_for_insert:
-                    ChatMessages.update_message(
-                        msg_id_str, status=status_for_insert)
-                log.debug(f"legacy_to_normalized_format: Successfully created message {msg_id_str}, role={msg_data.get('role')}")
-                processed_count += 1
             except Exception as e:
-                log.error(f"legacy_to_normalized_format: Exception creating message {msg_id_str}: {str(e)}", exc_info=True)
+                log.error(f"legacy_to_normalized_format: Invalid message {msg_id_str}: {str(e)}", exc_info=True)
                 error_count += 1
+                continue
 
-            # For "Save as Copy" scenarios, ensure cost is set to 0 for the duplicated message
-            if msg_data.get("usage") or msg_data.get("status"):
-                # Update the message with usage/status but explicitly set cost to 0
-                # We need to update via direct DB access since update_message extracts cost from usage
-                with get_db() as db:
-                    from decimal import Decimal
-                    new_message = db.get(ChatMessage, msg_id_str)
-                    if new_message:
-                        # Set usage and status if provided
-                        if msg_data.get("usage"):
-                            new_message.usage = msg_data.get("usage")
-                        if msg_data.get("status"):
-                            new_message.status = msg_data.get("status")
-
-                        # Explicitly set cost to 0 for copied messages
-                        new_message.cost = Decimal('0')
-
-                        # Extract and store tokens from usage (but keep cost at 0)
-                        if msg_data.get("usage"):
-                            from open_webui.models.chat_messages import extract_tokens_from_usage
-                            input_tokens, output_tokens, reasoning_tokens = extract_tokens_from_usage(msg_data.get("usage"))
-                            new_message.input_tokens = input_tokens
-                            new_message.output_tokens = output_tokens
-                            new_message.reasoning_tokens = reasoning_tokens
-
-                        db.commit()
-                        log.debug(f"legacy_to_normalized_format: Set cost to 0 for copied message {msg_id_str}")
+            # Position for sibling ordering, as insert_message computes it
+            if form.meta and "modelIdx" in form.meta:
+                position = form.meta.get("modelIdx", 0)
+            else:
+                position = next_sibling_position(form.parent_id)
+
+            # For "Save as Copy" scenarios, usage/status are copied but cost is explicitly 0
+            # (the original message already accounted for it); tokens still come from usage
+            cost = None
+            input_tokens = output_tokens = reasoning_tokens = None
+            if usage or raw_status:
+                cost = Decimal('0')
+                if raw_status:
+                    status_for_insert = raw_status
+                if usage:
+                    input_tokens, output_tokens, reasoning_tokens = extract_tokens_from_usage(usage)
+
+            to_insert.append({
+                "id": msg_id_str,
+                "chat_id": chat_id,
+                "parent_id": form.parent_id,
+                "role": form.role,
+                "model_id": form.model_id,
+                "position": position,
+                "content_text": form.content_text,
+                "content_json": form.content_json,
+                "status": status_for_insert or None,
+                "usage": usage or None,
+                "cost": cost,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "reasoning_tokens": reasoning_tokens,
+                "meta": form.meta,
+                "annotation": form.annotation,
+                "feedback_id": form.feedback_id,
+                "selected_model_id": form.selected_model_id,
+                "created_at": msg_created_at if msg_created_at is not None else now,
+                "updated_at": now,
+            })
+            for att in form.attachments or []:
+                attachments_to_insert.append({
+                    "id": str(uuid.uuid4()),
+                    "message_id": msg_id_str,
+                    "type": att.get("type", "file"),
+                    "file_id": att.get("file_id"),
+                    "url": att.get("url"),
+                    "mime_type": att.get("mime_type"),
+                    "size_bytes": att.get("size_bytes"),
+                    "meta": att.get("metadata") or att.get("meta"),
+                    "created_at": now,
+                })
+
+    # Write all queued messages in one transaction: bulk INSERT of new messages and their
+    # attachments, then a bulk UPDATE (executemany by primary key) of existing ones
+    if to_insert or to_update:
+        try:
+            with get_db() as db:
+                if to_insert:
+                    db.execute(insert(ChatMessage), to_insert)
+                if attachments_to_insert:
+                    db.execute(insert(ChatMessageAttachment), attachments_to_insert)
+                if to_update:
+                    db.execute(update(ChatMessage), to_update)
+                db.commit()
+            processed_count += len(to_insert) + len(to_update)
+            log.debug("legacy_to_normalized_format: Created %s and updated %s messages", len(to_insert), len(to_update))
+        except Exception as e:
+            log.error(f"legacy_to_normalized_format: Exception writing messages for chat {chat_id}: {str(e)}", exc_info=True)
+            error_count += len(to_insert) + len(to_update)
 
     # Update chat's active_message_id
-    # Convert to string to ensure consistent format
     if current_id:
-        current_id_str = str(current_id) if current_id else None
-        if regenerate_ids and current_id_str:
-            current_id_str = id_map.get(current_id_str, current_id_str)
+        current_id_str = id_map.get(current_id, current_id) if regenerate_ids else current_id
         if current_id_str:
             try:
                 Chats.update_chat_active_and_root_message_ids(chat_id, active_message_id=current_id_str)
-                log.debug(f"legacy_to_normalized_format: Set active_message_id to {current_id_str}")
+                log.debug("legacy_to_normalized_format: Set active_message_id to %s", current_id_str)
             except Exception as e:
                 log.error(f"legacy_to_normalized_format: Exception setting active_message_id: {str(e)}", exc_info=True)
 
@@ -1193,7 +1405,7 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
             # Strip collections to remove files array and data.file_ids
             stripped_files = [strip_collection_files(f) for f in files_list]
             chat_blob_update["files"] = stripped_files
-            log.debug(f"legacy_to_normalized_format: Preserving {len(stripped_files)} chat-level files in chat blob (collections stripped)")
+            log.debug("legacy_to_normalized_format: Preserving %s chat-level files in chat blob (collections stripped)", len(stripped_files))
         else:
             chat_blob_update["files"] = files_list
 
@@ -1209,7 +1421,6 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
     # Update chat blob with files and/or params if we have updates
     if chat_blob_update:
         # Get existing chat blob and merge updates
-        from open_webui.models.chats import Chat
         with get_db() as db:
             chat_item = db.query(Chat).filter_by(id=chat_id).first()
             if chat_item:
@@ -1217,11 +1428,10 @@ def legacy_to_normalized_format(chat_id: str, legacy_chat: Dict, regenerate_ids:
                 updated_chat = {**existing_chat, **chat_blob_update}
                 chat_item.chat = updated_chat
                 db.commit()
-                log.debug(f"legacy_to_normalized_format: Updated chat blob with files and/or params")
+                log.debug("legacy_to_normalized_format: Updated chat blob with files and/or params")
 
     # Update models: store in first user message's meta (not in params)
     if "models" in legacy_chat:
-        from open_webui.models.chat_messages import ChatMessages
         # Find the first user message and update its meta
         with get_db() as db:
             first_user_msg = db.query(ChatMessage).filter_by(
@@ -84,10 +84,11 @@ class ChatMessageAttachment(Base):
 class MetricsDailyRollup(Base):
     __tablename__ = "metrics_daily_rollup"
 
-    id = Column(String, primary_key=True)
-    user_id = Column(String, nullable=False, index=True)
-    date = Column(Date, nullable=False, index=True)
-    model_id = Column(Text, nullable=True, index=True)
+    # (user_id, date, model_id) is the primary key on PostgreSQL; SQLite installs
+    # still carry the legacy md5 `id` column, which is never read through the ORM.
+    user_id = Column(String, primary_key=True, index=True)
+    date = Column(Date, primary_key=True, index=True)
+    model_id = Column(Text, primary_key=True, index=True)
     message_count = Column(Integer, nullable=False, server_default='0')
     total_cost = Column(Numeric(precision=10, scale=8), nullable=False, server_default='0')
     total_input_tokens = Column(Integer, nullable=False, server_default='0')
@@ -446,6 +447,21 @@ class ChatMessagesTable:
             log.debug(f"ChatMessages.update_message: Successfully updated message {message_id}")
             return ChatMessageModel.model_validate(message)
 
+    def ensure_metrics_rollup_partitions(self, months_ahead: int = 2) -> None:
+        """Create the monthly metrics_daily_rollup partitions for this month and the next few (PostgreSQL only)."""
+        with get_db() as db:
+            if not (db.bind and db.bind.dialect.name == "postgresql"):
+                return
+            db.execute(
+                text(
+                    "SELECT ensure_metrics_daily_rollup_partition("
+                    "(date_trunc('month', CURRENT_DATE) + make_interval(months => m))::date) "
+                    "FROM generate_series(0, :months_ahead) AS m"
+                ),
+                {"months_ahead": months_ahead},
+            )
+            db.commit()
+
     def get_branch_to_root(self, chat_id: str, leaf_id: str) -> List[ChatMessageModel]:
         with get_db() as db:
             seq = []
@@ -665,6 +681,8 @@ class ChatMessagesTable:
                 created_at=ts,
             )
             db.add(att)
+            # Bump the message so readers keyed on updated_at see the new attachment
+            message.updated_at = ts
             db.commit()
             db.refresh(att)
             log.debug(f"ChatMessages.add_attachment: Added attachment {att.id} to message {message_id} (type: {att.type})")
@@ -23,6 +23,13 @@ from open_webui.utils.access_control import has_access
 log = logging.getLogger(__name__)
 log.setLevel(SRC_LOG_LEVELS["MODELS"])
 
+# In-memory cache for model display names
+# Key: model_id, Value: (model_name, cached_at). Cleared whenever this process writes
+# to the model table; the TTL bounds staleness for edits made by other workers.
+MODEL_NAME_CACHE_TTL = 300
+MODEL_NAME_CACHE_MAX_SIZE = 2048
+_model_name_cache: dict[str, tuple[str, float]] = {}
+
 
 ####################
 # Models DB Schema
@@ -178,6 +185,7 @@ class ModelsTable:
                 db.add(result)
                 db.commit()
                 db.refresh(result)
+                _model_name_cache.clear()
 
                 if result:
                     return ModelModel.model_validate(result)
@@ -509,6 +517,49 @@ class ModelsTable:
         except Exception:
             return None
 
+    def get_models_by_ids(self, ids: list[str]) -> list[ModelModel]:
+        """
+        Fetch multiple models by their IDs in a single query.
+
+        Models that don't exist are not included in the result.
+        """
+        if not ids:
+            return []
+
+        try:
+            with get_db() as db:
+                return [
+                    ModelModel.model_validate(model)
+                    for model in db.query(Model).filter(Model.id.in_(ids)).all()
+                ]
+        except Exception:
+            return []
+
+    def get_model_names_by_ids(self, ids: list[str]) -> dict[str, str]:
+        """
+        Map model IDs to display names, falling back to the ID for models without a
+        name or without a row (e.g. connection models). Names are cached in-process.
+        """
+        now = time.time()
+        names = {}
+        missing = []
+        for id in set(ids):
+            cached = _model_name_cache.get(id)
+            if cached and now - cached[1] < MODEL_NAME_CACHE_TTL:
+                names[id] = cached[0]
+            else:
+                missing.append(id)
+
+        if missing:
+            found = {model.id: model.name or model.id for model in self.get_models_by_ids(missing)}
+            if len(_model_name_cache) + len(missing) > MODEL_NAME_CACHE_MAX_SIZE:
+                _model_name_cache.clear()
+            for id in missing:
+                names[id] = found.get(id, id)
+                _model_name_cache[id] = (names[id], now)
+
+        return names
+
     def toggle_model_by_id(self, id: str) -> Optional[ModelModel]:
         with get_db() as db:
             try:
@@ -536,6 +587,7 @@ class ModelsTable:
                     .update(model.model_dump(exclude={"id"}))
                 )
                 db.commit()
+                _model_name_cache.clear()
 
                 model = db.get(Model, id)
                 db.refresh(model)
@@ -549,6 +601,7 @@ class ModelsTable:
             with get_db() as db:
                 db.query(Model).filter_by(id=id).delete()
                 db.commit()
+                _model_name_cache.clear()
 
                 return True
         except Exception:
@@ -559,6 +612,7 @@ class ModelsTable:
             with get_db() as db:
                 db.query(Model).delete()
                 db.commit()
+                _model_name_cache.clear()
 
                 return True
         except Exception:
@@ -18,6 +18,7 @@ from open_webui.config import ENABLE_ADMIN_CHAT_ACCESS, ENABLE_ADMIN_EXPORT
 from open_webui.constants import ERROR_MESSAGES
 from open_webui.env import SRC_LOG_LEVELS
 from fastapi import APIRouter, Depends, HTTPException, Request, Query, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 
@@ -524,6 +525,45 @@ async def get_chat_by_id(id: str, user=Depends(get_verified_user), export: bool
     return ChatResponse(**chat.model_dump())
 
 
+############################
+# StreamChatById
+############################
+
+
+@router.get("/{id}/stream")
+async def stream_chat_by_id(id: str, user=Depends(get_verified_user), export: bool = Query(False)):
+    """
+    Same content as GET /{id}, streamed as newline-delimited JSON (see
+    iter_legacy_format_ndjson) so very large chats don't have to be encoded as one body.
+    """
+    chat = Chats.get_chat_by_id_and_user_id(id, user.id)
+
+    if not chat:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail=ERROR_MESSAGES.NOT_FOUND
+        )
+
+    from open_webui.models.chat_messages import ChatMessage
+    from open_webui.models.chat_converter import (
+        iter_legacy_format_ndjson,
+        normalized_to_legacy_format,
+    )
+
+    with get_db() as db:
+        has_normalized = db.query(ChatMessage).filter_by(chat_id=id).first() is not None
+
+    if has_normalized:
+        chat_content = normalized_to_legacy_format(id, embed_files_as_base64=export)
+    else:
+        chat_content = chat.chat or {}
+
+    chat_info = ChatResponse(**{**chat.model_dump(), "chat": {}}).model_dump(exclude={"chat"})
+    return StreamingResponse(
+        iter_legacy_format_ndjson(chat_info, chat_content),
+        media_type="application/x-ndjson",
+    )
+
+
 ############################
 # GetChatMeta (lightweight)
 ############################
@@ -921,7 +961,11 @@ async def update_chat_by_id(
     
     # Check if this chat uses normalized storage
     from open_webui.models.chat_messages import ChatMessage
-    from open_webui.models.chat_converter import legacy_to_normalized_format, normalized_to_legacy_format
+    from open_webui.models.chat_converter import (
+        invalidate_legacy_format_cache,
+        legacy_to_normalized_format,
+        normalized_to_legacy_format,
+    )
     from open_webui.models.chats import Chat
     
     with get_db() as db:
@@ -967,6 +1011,11 @@ async def update_chat_by_id(
             if history_current_id:
                 Chats.update_chat_active_and_root_message_ids(id, active_message_id=history_current_id)
         
+        # The title/params writes above don't change the cache version key (chat.updated_at,
+        # active message, message count/updated_at), so drop the cached copy explicitly;
+        # otherwise the old params would be served and written back into chat.chat below
+        invalidate_legacy_format_cache(id)
+
         # Generate legacy response for the API response (includes full message history)
         legacy_chat_response = normalized_to_legacy_format(id)
         
@@ -0,0 +1,25 @@
+from open_webui.models.chat_converter import get_last_sentence
+
+
+def test_get_last_sentence_trailing_punctuation():
+    assert get_last_sentence("Hello world. Foo bar.") == "Foo bar."
+    assert get_last_sentence("Hi! How are you?") == "How are you?"
+    assert get_last_sentence("Wait. Really?!") == "Really?!"
+
+
+def test_get_last_sentence_unterminated_tail():
+    assert get_last_sentence("One. Two") == "Two"
+    assert get_last_sentence("No punctuation at all") == "No punctuation at all"
+
+
+def test_get_last_sentence_punctuation_only():
+    assert get_last_sentence("...") == "..."
+    assert get_last_sentence("?!") == "?!"
+
+
+def test_get_last_sentence_whitespace():
+    assert get_last_sentence("A.  B c.  ") == "B c."
+    assert get_last_sentence("First.\n\nSecond line.\n") == "Second line."
+    assert get_last_sentence("   ") is None
+    assert get_last_sentence("") is None
+    assert get_last_sentence(None) is None
@@ -1,3 +1,4 @@
+import json
 import uuid
 
 from test.util.abstract_integration_test import AbstractPostgresTest
@@ -234,3 +235,52 @@ class TestChats(AbstractPostgresTest):
 
         chat = self.chats.get_chat_by_id(chat_id)
         assert chat.share_id is None
+
+    def test_stream_chat_by_id(self):
+        from open_webui.models.chats import ChatForm
+
+        user_message = {
+            "id": "m1",
+            "parentId": None,
+            "childrenIds": ["m2"],
+            "role": "user",
+            "content": "Hello",
+        }
+        assistant_message = {
+            "id": "m2",
+            "parentId": "m1",
+            "childrenIds": [],
+            "role": "assistant",
+            "content": "Hi there.",
+            "model": "model1",
+        }
+        chat = self.chats.insert_new_chat(
+            "2",
+            ChatForm(
+                **{
+                    "chat": {
+                        "name": "chat2",
+                        "tags": ["tag1"],
+                        "history": {
+                            "currentId": "m2",
+                            "messages": {"m1": user_message, "m2": assistant_message},
+                        },
+                        "messages": [user_message, assistant_message],
+                    }
+                }
+            ),
+        )
+        with mock_webui_user(id="2"):
+            expected = self.fast_api_client.get(self.create_url(f"/{chat.id}")).json()
+            response = self.fast_api_client.get(self.create_url(f"/{chat.id}/stream"))
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+
+        lines = [json.loads(line) for line in response.text.splitlines() if line]
+        assert lines[0]["type"] == "chat"
+        data = lines[0]["chat"]
+        data["chat"]["history"]["messages"] = {
+            line["message"]["id"]: line["message"] for line in lines if line["type"] == "message"
+        }
+        data["chat"]["messages"] = [line["message"] for line in lines if line["type"] == "branch"]
+        assert data == expected